@@ -1,16 +1,20 @@
 import streamlit as st
 import os
+import json
+import hashlib
+import itertools
 import tempfile
-# Updated imports for PyPDFLoader and TextLoader
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.document_loaders import TextLoader
-from langchain_google_community import GoogleDriveLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
 import traceback
 from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from embedding_engines import EMBEDDING_MODEL_NAME, EMBEDDING_ENGINE, DEFAULT_ENGINE, engine_settings, get_embedding_model
+from document_processing import is_supported_file, load_document_pages
+from corpus_store import Corpus, build_vector_store
+from index_library import INDEX_LIBRARY_DIR, list_index_bundles, load_index_bundle
+from drive_sync import DriveSync, atomic_write, mirror_lock
+from llm_gateway import GatewayError, get_llm_gateway, make_chat_model
+from summary_index import build_summary_index
 
 # Load environment variables from .env file if present (good practice)
 load_dotenv()
@@ -31,15 +35,18 @@ st.write("Welcome! Use the sidebar to upload documents, load from Google Drive,
 # (Keep existing session state initializations)
 if "deepseek_api_key" not in st.session_state: st.session_state.deepseek_api_key = None
 if "deepseek_base_url" not in st.session_state: st.session_state.deepseek_base_url = None
-if "processed_text" not in st.session_state: st.session_state.processed_text = None
-if "text_chunks" not in st.session_state: st.session_state.text_chunks = None
+if "corpus" not in st.session_state: st.session_state.corpus = None # Single copy of the processed text; chunks are views into it
 if "vector_store" not in st.session_state: st.session_state.vector_store = None
+if "summary_index" not in st.session_state: st.session_state.summary_index = None
 if "rag_ready" not in st.session_state: st.session_state.rag_ready = False
 if "flashcards_ready" not in st.session_state: st.session_state.flashcards_ready = False
 if "gdrive_folder_id" not in st.session_state: st.session_state.gdrive_folder_id = ""
 if "gdrive_docs_loaded" not in st.session_state: st.session_state.gdrive_docs_loaded = False
-if "gdrive_loaded_text" not in st.session_state: st.session_state.gdrive_loaded_text = ""
+# Only paths and versions are kept per session; the extracted text stays on disk until it is written into the corpus
+if "gdrive_mirror_dir" not in st.session_state: st.session_state.gdrive_mirror_dir = None
+if "gdrive_files" not in st.session_state: st.session_state.gdrive_files = {} # mirror path -> md5Checksum/modifiedTime
 SERVICE_ACCOUNT_KEY_FILE = "service_account.json"
+GDRIVE_MIRROR_DIR = os.getenv("cerebro_gdrive_mirror_dir", ".gdrive_mirror")
 
 
 # --- Load DeepSeek Credentials from Environment Variables ---
@@ -72,10 +79,53 @@ st.session_state.gdrive_folder_id = st.sidebar.text_input(
     help=f"Find the Folder ID in the URL. Ensure '{SERVICE_ACCOUNT_KEY_FILE}' is in the app's root directory and the folder is shared with the service account email."
 )
 
-# Updated function to use Service Account Key
+def file_version(manifest_entry):
+    return manifest_entry.get("md5Checksum") or manifest_entry.get("modifiedTime")
+
+def extraction_cache_path(mirror_dir, path, version):
+    # Beside the mirror rather than inside it, so it can never collide with a synced Drive path.
+    # Keyed by path and version: sessions holding different versions of a file never overwrite each other's entries.
+    key = hashlib.sha1(f"{path}\0{version}".encode("utf-8")).hexdigest()
+    return os.path.join(mirror_dir + ".extracted", key + ".json")
+
+def extract_drive_file(mirror_dir, path, version):
+    """Extracts a mirrored file's pages into the on-disk cache; returns False if the cache already held this version."""
+    cache_path = extraction_cache_path(mirror_dir, path, version)
+    if os.path.exists(cache_path): return False
+    pages = load_document_pages(os.path.join(mirror_dir, path))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    atomic_write(cache_path, json.dumps({"path": path, "version": version, "pages": pages}).encode("utf-8"))
+    return True
+
+def prune_extraction_cache(syncer):
+    """Deletes cached extractions that the mirror's manifest no longer refers to; run under the mirror lock."""
+    with mirror_lock(syncer.mirror_dir):
+        manifest_files = syncer.load_manifest().get("files", {}).values()
+        keep = {os.path.basename(extraction_cache_path(syncer.mirror_dir, entry["path"], file_version(entry))) for entry in manifest_files}
+        cache_dir = syncer.mirror_dir + ".extracted"
+        for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            if name not in keep:
+                try: os.remove(os.path.join(cache_dir, name))
+                except FileNotFoundError: pass
+
+def iter_drive_documents(mirror_dir, files):
+    """Yields (name, pages) for the synced Drive files, reading one cached extraction at a time."""
+    for path, version in sorted(files.items()):
+        try:
+            with open(extraction_cache_path(mirror_dir, path, version), encoding="utf-8") as f:
+                pages = json.load(f)["pages"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            # Pruned after another session synced a newer version; the mirror holds the current one
+            try:
+                pages = load_document_pages(os.path.join(mirror_dir, path))
+                st.sidebar.info(f"{path} changed on Google Drive since it was loaded; using the current version.")
+            except Exception as load_error:
+                st.sidebar.warning(f"Skipped {path}: it is no longer in the Google Drive mirror ({load_error}). Reload from Google Drive.")
+                continue
+        yield f"Google Drive Document: {path}", pages
+
 def load_from_google_drive(folder_id):
-    """Loads documents from Google Drive folder using a Service Account."""
-    # (Keep existing GDrive loading logic)
+    """Syncs a Google Drive folder tree into the local mirror; returns (mirror_dir, {path: version}) for the extracted files."""
     if not folder_id:
         st.sidebar.warning("Please enter a Google Drive Folder ID.")
         return None
@@ -84,45 +134,59 @@ def load_from_google_drive(folder_id):
          st.sidebar.info("Download Service Account key and place it here. Share Drive folder with service account email.")
          return None
     try:
-        st.sidebar.info(f"Loading from GDrive Folder: {folder_id} (Service Account)")
+        st.sidebar.info(f"Syncing GDrive Folder: {folder_id} (Service Account)")
         credentials = service_account.Credentials.from_service_account_file(
             os.path.join(os.path.dirname(__file__), "service_account.json"),
             scopes=['https://www.googleapis.com/auth/drive']
         )
-        loader = GoogleDriveLoader(
-            folder_id=folder_id,
-            credentials=credentials,
-            recursive=False
-        )
-        docs = loader.load()
-        if not docs:
+        mirror_dir = os.path.join(GDRIVE_MIRROR_DIR, folder_id)
+        syncer = DriveSync(lambda: build("drive", "v3", credentials=credentials, cache_discovery=False), mirror_dir)
+        result = syncer.sync(folder_id)
+        st.sidebar.caption(f"Drive sync: {len(result.added)} new, {len(result.changed)} changed, "
+                           f"{len(result.removed)} removed, {len(result.unchanged)} unchanged.")
+        for path, error in result.failed:
+            st.sidebar.warning(f"Could not download {path}: {error}")
+
+        # Only new/changed files are re-extracted; unchanged ones reuse the cached text from a previous sync
+        versions = {entry["path"]: file_version(entry) for entry in syncer.load_manifest().get("files", {}).values()}
+        failed_paths = {p for p, _ in result.failed}
+        files, extracted = {}, 0
+        for path in result.added + result.changed + result.unchanged:
+            if path in failed_paths: continue
+            try:
+                extracted += extract_drive_file(mirror_dir, path, versions.get(path))
+                files[path] = versions.get(path)
+            except Exception as load_error:
+                st.sidebar.warning(f"Could not process {path}: {load_error}")
+        # Drop cached text of removed, renamed or outdated files; other sessions' current entries are kept
+        prune_extraction_cache(syncer)
+
+        if not files:
             st.sidebar.warning("No documents found/loaded. Check Folder ID & sharing.")
-            return ""
-        st.sidebar.success(f"Loaded {len(docs)} document(s) from Google Drive.")
-        full_text = "\n\n".join([doc.page_content for doc in docs])
-        return full_text
+            return mirror_dir, {}
+        st.sidebar.success(f"Loaded {len(files)} document(s) from Google Drive ({extracted} re-processed).")
+        return mirror_dir, files
     except Exception as e:
         st.sidebar.error(f"Google Drive loading error: {e}")
         st.sidebar.code(traceback.format_exc())
-        if "fileNotFound" in str(e): st.sidebar.warning("Folder not found or not shared.")
+        if "fileNotFound" in str(e) or "notFound" in str(e): st.sidebar.warning("Folder not found or not shared.")
         elif "invalid_grant" in str(e).lower(): st.sidebar.error("Auth error: Invalid grant.")
         return None
 
 if st.sidebar.button("Load Files from Google Drive", key="load_gdrive_btn"):
-     loaded_text = load_from_google_drive(st.session_state.gdrive_folder_id)
-     if loaded_text is not None:
-         st.session_state.gdrive_loaded_text = loaded_text
-         st.session_state.gdrive_docs_loaded = bool(loaded_text)
-         if not loaded_text: st.sidebar.info("No text content loaded from Google Drive.")
+     loaded = load_from_google_drive(st.session_state.gdrive_folder_id)
+     if loaded is not None:
+         st.session_state.gdrive_mirror_dir, st.session_state.gdrive_files = loaded
+         st.session_state.gdrive_docs_loaded = bool(st.session_state.gdrive_files)
+         if not st.session_state.gdrive_files: st.sidebar.info("No text content loaded from Google Drive.")
      else:
          st.session_state.gdrive_docs_loaded = False
 
 
 # --- Document Processing Functions ---
-def get_document_text_from_uploads(files):
-    """Loads text from manually uploaded files."""
-    # Uses the updated imports for PyPDFLoader and TextLoader
-    full_text = ""
+def get_documents_from_uploads(files):
+    """Loads manually uploaded files as (name, pages) pairs."""
+    documents = []
     temp_dir = tempfile.mkdtemp()
     processed_files = []
     skipped_files = []
@@ -131,14 +195,10 @@ def get_document_text_from_uploads(files):
             file_path = os.path.join(temp_dir, file.name)
             with open(file_path, "wb") as f: f.write(file.getvalue())
             try:
-                if file.type == "application/pdf": loader = PyPDFLoader(file_path) # Uses updated import
-                elif file.type == "text/plain": loader = TextLoader(file_path) # Uses updated import
-                else:
+                if not is_supported_file(file_path):
                     skipped_files.append(f"{file.name} (Unsupported type: {file.type})")
                     continue
-                documents = loader.load()
-                file_text = "\n\n".join([doc.page_content for doc in documents])
-                full_text += f"\n\n--- Uploaded Document: {file.name} ---\n\n" + file_text
+                documents.append((f"Uploaded Document: {file.name}", load_document_pages(file_path)))
                 processed_files.append(file.name)
             except Exception as load_error: st.sidebar.warning(f"Could not process {file.name}: {load_error}")
     except Exception as e: st.sidebar.error(f"Error during file handling: {e}")
@@ -153,24 +213,17 @@ def get_document_text_from_uploads(files):
     if skipped_files: st.sidebar.write("Skipped Uploads:")
     for name in skipped_files: st.sidebar.caption(f"- {name}")
 
-    return full_text.strip() if full_text else ""
-
-def get_text_chunks_from_text(text):
-    """Splits text into chunks."""
-    if not text: return None
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-    chunks = text_splitter.split_text(text)
-    return chunks
+    return documents
 
-def get_vector_store(text_chunks):
-    """Creates a FAISS vector store using BGE embeddings."""
-    if not text_chunks: return None
-    model_name = "BAAI/bge-base-en-v1.5"
-    st.sidebar.caption(f"Using Embedding Model: {model_name} (running locally)")
+def get_vector_store(corpus):
+    """Creates a FAISS vector store over the corpus chunks using BGE embeddings."""
+    if not corpus or not len(corpus): return None
+    model_name = EMBEDDING_MODEL_NAME
+    st.sidebar.caption(f"Using Embedding Model: {model_name} (running locally, engine: {EMBEDDING_ENGINE})")
     try:
-        embeddings = HuggingFaceEmbeddings(model_name=model_name)
         st.sidebar.info(f"Loading embedding model '{model_name}' locally...")
-        vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
+        embeddings = get_embedding_model(model_name) # Shared with the chat query encoder
+        vector_store = build_vector_store(corpus, embeddings) # Docstore reads chunk text from the corpus
         st.sidebar.info("Embedding model loaded.")
         return vector_store
     except ImportError:
@@ -189,37 +242,109 @@ uploaded_files = st.sidebar.file_uploader(
 
 # Combined Processing Button
 st.sidebar.markdown("---")
+build_summaries = st.sidebar.checkbox(
+    "Build summary index", key="build_summaries",
+    help="Summarises the documents section by section with the LLM, so broad questions like 'what are the main topics?' are answered from compact summaries. Costs extra API calls while processing."
+)
 if st.sidebar.button("Process All Loaded Files", key="process_button"):
-    upload_text = get_document_text_from_uploads(uploaded_files) if uploaded_files else ""
-    gdrive_text = st.session_state.gdrive_loaded_text
-    combined_text = (upload_text + "\n\n" + gdrive_text).strip()
-    if not combined_text:
+    upload_docs = get_documents_from_uploads(uploaded_files) if uploaded_files else []
+    drive_docs = iter_drive_documents(st.session_state.gdrive_mirror_dir, st.session_state.gdrive_files) if st.session_state.gdrive_files else []
+    # A generator: Drive documents are read from the extraction cache and written into the corpus one at a time
+    combined_docs = ((name, pages) for name, pages in itertools.chain(upload_docs, drive_docs) if any(page.strip() for page in pages))
+    if not upload_docs and not st.session_state.gdrive_files:
          st.sidebar.warning("No text content found from uploads or Google Drive to process.")
     else:
         with st.spinner("Processing combined text..."):
-            st.session_state.processed_text = None
-            st.session_state.text_chunks = None
+            st.session_state.corpus = None
             st.session_state.vector_store = None
+            st.session_state.summary_index = None
             st.session_state.rag_ready = False
             st.session_state.flashcards_ready = False
             st.session_state.pop('flashcards', None)
             st.session_state.pop('mcqs', None)
-            st.session_state.processed_text = combined_text
-            st.session_state.flashcards_ready = True
-            st.sidebar.success("Combined text available for generation.")
-            chunks = get_text_chunks_from_text(combined_text)
-            if chunks:
-                st.session_state.text_chunks = chunks
-                vs = get_vector_store(chunks)
+            corpus = Corpus.build(combined_docs)
+            if not corpus:
+                st.sidebar.warning("No text content found from uploads or Google Drive to process.")
+            else:
+                st.session_state.corpus = corpus
+                st.session_state.flashcards_ready = True
+                st.sidebar.success(f"Combined text available for generation ({corpus.num_bytes / 1e6:.1f} MB, memory-mapped).")
+            if len(corpus):
+                vs = get_vector_store(corpus)
                 if vs:
                     st.session_state.vector_store = vs
                     st.session_state.rag_ready = True
                     st.sidebar.success("Vector store created using local BGE model.")
+                    if build_summaries:
+                        try:
+                            with st.spinner("Building summary index..."):
+                                model = make_chat_model(st.session_state.deepseek_api_key, st.session_state.deepseek_base_url,
+                                                        st.session_state.chat_model, temperature=0.2)
+                                st.session_state.summary_index = build_summary_index(
+                                    corpus, get_embedding_model(EMBEDDING_MODEL_NAME), model, get_llm_gateway())
+                            st.sidebar.success(f"Summary index built ({len(st.session_state.summary_index)} nodes).")
+                            if st.session_state.summary_index.skipped:
+                                st.sidebar.warning(f"{len(st.session_state.summary_index.skipped)} summaries failed and were left out; "
+                                                   "broad questions about those parts use the document chunks.")
+                        except GatewayError as e:
+                            st.sidebar.warning(f"Summary index skipped: {e}")
+                        except Exception as e:
+                            # Optional stage: chat still works from the document chunks without it
+                            st.session_state.summary_index = None
+                            st.sidebar.warning(f"Summary index skipped: {e}")
+                            st.sidebar.code(traceback.format_exc())
                 else:
                     st.sidebar.error("Failed to create vector store.")
-            else:
+            elif corpus:
                 st.sidebar.warning("Could not split combined text into chunks.")
 
+# --- Sidebar: Prebuilt Index Library ---
+@st.cache_resource(show_spinner=False)
+def open_index_bundle(bundle_dir):
+    """Loads a prebuilt bundle once per process; sessions opening it share the same store."""
+    return load_index_bundle(bundle_dir, get_embedding_model(EMBEDDING_MODEL_NAME))
+
+st.sidebar.markdown("---")
+st.sidebar.header("Index Library")
+index_bundles = list_index_bundles()
+if not index_bundles:
+    st.sidebar.caption(f"No prebuilt indexes in `{INDEX_LIBRARY_DIR}`. Build one with `python build_index.py <folder> --name <name>`.")
+else:
+    bundle_labels = [f"{b['name']} (v{b['version']:04d}, {b['num_files']} files)" for b in index_bundles]
+    selected_label = st.sidebar.selectbox("Prebuilt index:", bundle_labels, key="index_bundle_select")
+    if st.sidebar.button("Open Prebuilt Index", key="open_bundle_btn"):
+        bundle = index_bundles[bundle_labels.index(selected_label)]
+        bundle_engine = bundle.get("embedding_engine", DEFAULT_ENGINE)
+        if bundle.get("embedding_model") != EMBEDDING_MODEL_NAME:
+            st.sidebar.error(f"Bundle was built with '{bundle.get('embedding_model')}', but the app uses '{EMBEDDING_MODEL_NAME}'. Rebuild it.")
+        elif bundle_engine != EMBEDDING_ENGINE and EMBEDDING_ENGINE != "remote":
+            # Engines produce slightly different vectors; mixing them degrades retrieval silently
+            st.sidebar.error(f"Bundle was built with the '{bundle_engine}' embedding engine, but the app uses '{EMBEDDING_ENGINE}'. "
+                             f"Set cerebro_embedding_engine={bundle_engine} or rebuild it with --engine {EMBEDDING_ENGINE}.")
+        elif bundle_engine == EMBEDDING_ENGINE and any(bundle.get(key) != value for key, value in engine_settings(EMBEDDING_ENGINE).items()):
+            mismatched = ", ".join(f"{key} '{bundle.get(key)}' (app: '{value}')" for key, value in engine_settings(EMBEDDING_ENGINE).items()
+                                   if bundle.get(key) != value)
+            st.sidebar.error(f"Bundle was built with different '{bundle_engine}' settings: {mismatched}. "
+                             f"Set cerebro_quantization_config to match or rebuild it.")
+        else:
+            if EMBEDDING_ENGINE == "remote" and bundle_engine != "remote":
+                settings = "".join(f", {key}={bundle[key]}" for key in engine_settings(bundle_engine) if key in bundle)
+                st.sidebar.warning(f"Bundle was built with the '{bundle_engine}' engine{settings}; make sure the embedding server runs with the same.")
+            try:
+                with st.spinner(f"Opening index '{bundle['name']}'..."):
+                    vs, bundle_corpus, bundle_summaries, _ = open_index_bundle(bundle["path"])
+                st.session_state.corpus = bundle_corpus
+                st.session_state.summary_index = bundle_summaries
+                st.session_state.vector_store = vs
+                st.session_state.rag_ready = True
+                st.session_state.flashcards_ready = True
+                st.session_state.pop('flashcards', None)
+                st.session_state.pop('mcqs', None)
+                st.sidebar.success(f"Opened '{bundle['name']}' ({bundle['num_chunks']} chunks).")
+            except Exception as e:
+                st.sidebar.error(f"Could not open index bundle: {e}")
+                st.sidebar.code(traceback.format_exc())
+
 # --- Main Page Content ---
 st.markdown("---")
 st.header("Instructions")
@@ -233,17 +358,26 @@ st.markdown(f"""
     *   Enter the Google Drive Folder ID in the sidebar & click "Load Files from Google Drive".
 4.  **Manual Upload (Optional):** Upload PDF/TXT files using the sidebar.
 5.  **Process Files:** Click "Process All Loaded Files". This combines text and generates local embeddings.
+    *   Or open a prebuilt course index from the "Index Library" section (build one offline with `python build_index.py <folder> --name <name>`).
 6.  **Navigate:** Use the sidebar navigation to switch between Cerebro Chat, Flashcards, and MC Questions.
 """)
 
+# --- Sidebar: LLM Gateway Counters ---
+with st.sidebar.expander("LLM Gateway Stats"):
+    gateway_stats = get_llm_gateway().stats()
+    st.caption("Shared by all sessions in this process.")
+    st.json(gateway_stats)
+    st.caption("Token usage per prompt template (cached = DeepSeek prefix-cache hits):")
+    st.json(get_llm_gateway().usage_stats())
+
 # Button for clearing processed data 
 if st.sidebar.button("Clear Processed Data", key="clear_data"):
-    st.session_state.processed_text = None
-    st.session_state.text_chunks = None
+    st.session_state.corpus = None
     st.session_state.vector_store = None
+    st.session_state.summary_index = None
     st.session_state.rag_ready = False
     st.session_state.flashcards_ready = False
-    st.session_state.gdrive_loaded_text = ""
+    st.session_state.gdrive_files = {}
     st.session_state.gdrive_docs_loaded = False
     st.session_state.pop('flashcards', None)
     st.session_state.pop('current_card_index', None)
@@ -0,0 +1,208 @@
+"""
+Headless bulk indexing for Cerebro.
+
+Walks a directory tree of PDF/TXT files and writes a versioned index bundle
+that the Streamlit app can open from the "Index Library" sidebar section.
+
+Usage:
+    python build_index.py path/to/course_material --name semester-1 --workers 4
+
+Every file is checkpointed (page text and chunk embeddings) as soon as it is done,
+so an interrupted run picks up where it left off when started again. Re-running with
+nothing changed reuses the latest version instead of writing an identical one.
+
+With --summaries, a hierarchical summary index for broad questions is also built
+through the DeepSeek API (DS_key and optionally deepseek_base_url must be set).
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from document_processing import CHUNK_SIZE, CHUNK_OVERLAP, is_supported_file, load_document_pages, split_document
+from corpus_store import Corpus, document_text, build_vector_store
+from index_library import INDEX_LIBRARY_DIR, latest_index_bundle, save_index_bundle
+from embedding_engines import EMBEDDING_MODEL_NAME, EMBEDDING_ENGINE, EMBEDDING_ENGINES, engine_settings, load_embedding_model
+from llm_gateway import LLMGateway, make_chat_model
+from summary_index import build_summary_index
+
+CHECKPOINT_DIR_NAME = ".checkpoint"
+CHECKPOINT_FORMAT = 2 # Bump when the checkpoint record layout changes
+DEFAULT_DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+CHAT_MODEL_NAME = "deepseek-chat"
+
+
+def discover_files(source_dir):
+    """Returns the supported files under source_dir, relative and sorted for a stable corpus order."""
+    found = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if is_supported_file(path):
+                found.append(os.path.relpath(path, source_dir))
+    return found
+
+
+def checkpoint_key(source_dir, rel_path, engine):
+    """Identifies a file version and embedding setup, so edited files are re-indexed on resume."""
+    stat = os.stat(os.path.join(source_dir, rel_path))
+    fingerprint = f"{CHECKPOINT_FORMAT}|{rel_path}|{stat.st_size}|{stat.st_mtime_ns}|{EMBEDDING_MODEL_NAME}|{engine}|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+    settings = engine_settings(engine)
+    if settings: # e.g. the int8 quantization target; other engines keep their existing checkpoint keys
+        fingerprint += "|" + json.dumps(settings, sort_keys=True)
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+
+def document_name(rel_path):
+    return f"Document: {rel_path}"
+
+
+def extract_file(source_dir, rel_path):
+    """Worker process: loads one file and splits it exactly as Corpus.build will."""
+    pages = load_document_pages(os.path.join(source_dir, rel_path))
+    text, _ = document_text(document_name(rel_path), pages)
+    return rel_path, pages, [chunk for _, chunk in split_document(text)]
+
+
+def prune_checkpoints(checkpoint_dir, keep_paths):
+    """Deletes checkpoints of earlier file versions (and leftover temp files) that the current sources no longer use."""
+    keep = {os.path.basename(path) for path in keep_paths}
+    removed = 0
+    for entry in os.listdir(checkpoint_dir):
+        if entry not in keep:
+            os.remove(os.path.join(checkpoint_dir, entry))
+            removed += 1
+    if removed:
+        print(f"Removed {removed} stale checkpoint file(s).")
+
+
+def write_checkpoint(path, record):
+    # Write-then-rename so a killed run never leaves a half-written checkpoint behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+
+
+def build_index(source_dir, name, library_dir=INDEX_LIBRARY_DIR, workers=None, batch_size=64, engine=EMBEDDING_ENGINE,
+                summaries=False):
+    api_key = os.getenv("DS_key") or os.getenv("deepseek_api_key")
+    if summaries and not api_key:
+        print("--summaries needs the DeepSeek API key in the DS_key environment variable.", file=sys.stderr)
+        return None
+    files = discover_files(source_dir)
+    if not files:
+        print(f"No PDF/TXT files found under {source_dir}.")
+        return None
+
+    checkpoint_dir = os.path.join(library_dir, name, CHECKPOINT_DIR_NAME)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checkpoint_paths = {rel: os.path.join(checkpoint_dir, checkpoint_key(source_dir, rel, engine) + ".json") for rel in files}
+    pending = [rel for rel in files if not os.path.exists(checkpoint_paths[rel])]
+    print(f"{len(files)} file(s) found, {len(files) - len(pending)} already checkpointed, {len(pending)} to index.")
+    # Identifies the exact file versions and settings a bundle was built from
+    source_fingerprint = hashlib.sha1("|".join(os.path.basename(checkpoint_paths[rel]) for rel in files).encode("utf-8")).hexdigest()
+    latest = latest_index_bundle(name, library_dir)
+    if not pending and latest and latest.get("source_fingerprint") == source_fingerprint and latest.get("summaries", False) == summaries:
+        prune_checkpoints(checkpoint_dir, checkpoint_paths.values())
+        print(f"Nothing changed since {latest['path']}; no new version written.")
+        return latest["path"]
+
+    embeddings = load_embedding_model(EMBEDDING_MODEL_NAME, engine)
+    failed = []
+    if pending:
+        # Parsing runs in parallel worker processes; embedding stays in this process so the model is loaded once
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(extract_file, source_dir, rel): rel for rel in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                rel = futures[future]
+                try:
+                    _, pages, chunks = future.result()
+                    vectors = []
+                    for start in range(0, len(chunks), batch_size):
+                        vectors.extend(embeddings.embed_documents(chunks[start:start + batch_size]))
+                except Exception as e:
+                    failed.append(rel)
+                    print(f"[{done}/{len(pending)}] FAILED {rel}: {e}", file=sys.stderr)
+                    continue
+                write_checkpoint(checkpoint_paths[rel], {"source": rel, "pages": pages, "embeddings": vectors})
+                print(f"[{done}/{len(pending)}] {rel}: {len(chunks)} chunk(s)")
+
+    if failed:
+        print(f"{len(failed)} file(s) failed; fix them and re-run to resume. No bundle written.", file=sys.stderr)
+        return None
+
+    documents, vectors, sources = [], [], []
+    for rel in files:
+        with open(checkpoint_paths[rel], encoding="utf-8") as f:
+            record = json.load(f)
+        documents.append((document_name(rel), record["pages"]))
+        vectors.extend(record["embeddings"])
+        sources.append(rel)
+    if not vectors:
+        print("No text could be extracted from the source files.", file=sys.stderr)
+        return None
+
+    corpus = Corpus.build(documents)
+    if len(corpus) != len(vectors):
+        print(f"Checkpoint mismatch: {len(corpus)} chunks but {len(vectors)} embeddings. Delete {checkpoint_dir} and re-run.", file=sys.stderr)
+        return None
+    vector_store = build_vector_store(corpus, embeddings, vectors=vectors)
+    summary_index = None
+    if summaries:
+        print("Building summary index...")
+        model = make_chat_model(api_key, os.getenv("deepseek_base_url", DEFAULT_DEEPSEEK_BASE_URL), CHAT_MODEL_NAME, temperature=0.2)
+        try:
+            summary_index = build_summary_index(corpus, embeddings, model, LLMGateway())
+        except Exception as e:
+            # The chunk index is still useful without summaries; re-run with --summaries to add them
+            print(f"Summary index failed, writing the bundle without it: {e}", file=sys.stderr)
+        else:
+            print(f"Summary index: {len(summary_index)} nodes.")
+            for label in summary_index.skipped:
+                print(f"Summary skipped after repeated failures: {label}", file=sys.stderr)
+    bundle_dir = save_index_bundle(
+        vector_store,
+        corpus,
+        name,
+        {
+            "embedding_model": EMBEDDING_MODEL_NAME,
+            "embedding_engine": engine,
+            **engine_settings(engine),
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "num_files": len(sources),
+            "num_chunks": len(corpus),
+            "sources": sources,
+            "summary_nodes": len(summary_index) if summary_index else 0,
+            "summaries": summary_index is not None,
+            "source_fingerprint": source_fingerprint,
+        },
+        library_dir=library_dir,
+        summary_index=summary_index,
+    )
+    print(f"Wrote index bundle {bundle_dir} ({len(corpus)} chunks from {len(sources)} files).")
+    prune_checkpoints(checkpoint_dir, checkpoint_paths.values())
+    return bundle_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a Cerebro index bundle from a directory of PDF/TXT files.")
+    parser.add_argument("source_dir", help="Directory to index (searched recursively).")
+    parser.add_argument("--name", required=True, help="Bundle name shown in the app, e.g. 'semester-1'.")
+    parser.add_argument("--library", default=INDEX_LIBRARY_DIR, help=f"Index library directory (default: {INDEX_LIBRARY_DIR}).")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel file parsing processes (default: CPU count).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding batch.")
+    parser.add_argument("--summaries", action="store_true", help="Also build the summary index for broad questions (uses the LLM).")
+    parser.add_argument("--engine", default=EMBEDDING_ENGINE, choices=sorted(EMBEDDING_ENGINES), help=f"Embedding engine (default: {EMBEDDING_ENGINE}).")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.source_dir):
+        parser.error(f"{args.source_dir} is not a directory")
+    bundle_dir = build_index(args.source_dir, args.name, args.library, args.workers, args.batch_size, args.engine, args.summaries)
+    return 0 if bundle_dir else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
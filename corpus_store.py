@@ -0,0 +1,213 @@
+"""
+Single-copy corpus storage.
+
+All processed text lives once, as one contiguous UTF-8 buffer (memory-mapped from
+disk). Chunks are (offset, length, doc_id, page) records into that buffer, so the
+splitter overlap, the FAISS docstore and the generator pages all read the same bytes
+through lazy views instead of each holding their own copy of the text.
+"""
+import os
+import mmap
+import json
+import bisect
+import tempfile
+import numpy as np
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from document_processing import split_document
+
+RECORD_DTYPE = np.dtype([("offset", np.int64), ("length", np.int64), ("doc_id", np.int32), ("page", np.int32)])
+# Anonymous spill files for in-app corpora; unlinked on creation, so the OS reclaims them with the process
+CORPUS_TMP_DIR = os.getenv("cerebro_corpus_dir") or None
+BUFFER_FILE = "corpus.bin"
+RECORDS_FILE = "records.npy"
+DOCUMENTS_FILE = "documents.json"
+DOCUMENT_SEPARATOR = "\n\n"
+
+
+def document_text(name, pages):
+    """Returns a document's text as stored in the buffer, plus the char offset where each page starts."""
+    header = f"--- {name} ---\n\n"
+    page_starts = []
+    position = len(header)
+    for page in pages:
+        page_starts.append(position)
+        position += len(page) + len(DOCUMENT_SEPARATOR)
+    return header + DOCUMENT_SEPARATOR.join(pages), page_starts
+
+
+def _spill_to_mmap(buffer_file, write):
+    """Writes into an open binary file and returns a read-only map of it (or b"" if empty)."""
+    write(buffer_file)
+    buffer_file.flush()
+    if buffer_file.tell() == 0:
+        return b""
+    return mmap.mmap(buffer_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class CorpusChunks:
+    """Lazy sequence of chunk strings; each one is decoded from the buffer only when read."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return len(self.corpus.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.corpus.chunk_text(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class Corpus:
+    """One UTF-8 buffer plus an array of chunk records pointing into it."""
+
+    def __init__(self, buffer, records, documents, buffer_file=None):
+        self.buffer = buffer
+        self.records = records
+        self.documents = documents # doc_id -> name
+        self._buffer_file = buffer_file # Keeps the mapped file open for the lifetime of the corpus
+        self.chunks = CorpusChunks(self)
+
+    @classmethod
+    def build(cls, documents, storage_dir=None):
+        """
+        Builds a corpus from (name, [page_text, ...]) pairs.
+        With storage_dir the buffer is written to <storage_dir>/corpus.bin, otherwise to an anonymous temp file.
+        """
+        record_rows, names = [], []
+
+        def write_documents(f):
+            for doc_id, (name, pages) in enumerate(documents):
+                if doc_id:
+                    f.write(DOCUMENT_SEPARATOR.encode("utf-8"))
+                text, page_starts = document_text(name, pages)
+                base = f.tell()
+                # Splitter offsets are in characters; walk them in order to convert to byte offsets
+                char_cursor, byte_cursor = 0, 0
+                for start, chunk in split_document(text):
+                    byte_cursor += len(text[char_cursor:start].encode("utf-8"))
+                    char_cursor = start
+                    page = max(bisect.bisect_right(page_starts, start) - 1, 0)
+                    record_rows.append((base + byte_cursor, len(chunk.encode("utf-8")), doc_id, page))
+                f.write(text.encode("utf-8"))
+                names.append(name)
+
+        if storage_dir:
+            os.makedirs(storage_dir, exist_ok=True)
+            buffer_file = open(os.path.join(storage_dir, BUFFER_FILE), "w+b")
+        else:
+            buffer_file = tempfile.TemporaryFile(dir=CORPUS_TMP_DIR)
+        buffer = _spill_to_mmap(buffer_file, write_documents)
+        records = np.array(record_rows, dtype=RECORD_DTYPE)
+        corpus = cls(buffer, records, names, buffer_file)
+        if storage_dir:
+            corpus._write_index(storage_dir)
+        return corpus
+
+    @classmethod
+    def load(cls, storage_dir):
+        """Memory-maps a corpus previously written with build(storage_dir=...) or save()."""
+        buffer_file = open(os.path.join(storage_dir, BUFFER_FILE), "rb")
+        size = os.fstat(buffer_file.fileno()).st_size
+        buffer = mmap.mmap(buffer_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        records = np.load(os.path.join(storage_dir, RECORDS_FILE))
+        with open(os.path.join(storage_dir, DOCUMENTS_FILE), encoding="utf-8") as f:
+            documents = json.load(f)
+        return cls(buffer, records, documents, buffer_file)
+
+    def save(self, storage_dir):
+        os.makedirs(storage_dir, exist_ok=True)
+        with open(os.path.join(storage_dir, BUFFER_FILE), "wb") as f:
+            f.write(self.buffer[:])
+        self._write_index(storage_dir)
+
+    def _write_index(self, storage_dir):
+        np.save(os.path.join(storage_dir, RECORDS_FILE), self.records)
+        with open(os.path.join(storage_dir, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.documents, f)
+
+    # --- Views ---
+    def __len__(self):
+        return len(self.records)
+
+    def __bool__(self):
+        return len(self.buffer) > 0
+
+    @property
+    def num_bytes(self):
+        return len(self.buffer)
+
+    def chunk_text(self, index):
+        record = self.records[index]
+        start = int(record["offset"])
+        return self.buffer[start:start + int(record["length"])].decode("utf-8")
+
+    def chunk_document(self, index):
+        """Returns the chunk as a LangChain Document with its source name and page."""
+        record = self.records[index]
+        return Document(
+            page_content=self.chunk_text(index),
+            metadata={"chunk": int(index), "source": self.documents[int(record["doc_id"])], "page": int(record["page"]) + 1},
+        )
+
+    def span_text(self, first, last):
+        """Text covered by chunks first..last (inclusive), read once from the buffer without the overlaps repeated."""
+        start = int(self.records[first]["offset"])
+        end = int(max(self.records[i]["offset"] + self.records[i]["length"] for i in range(first, last + 1)))
+        return self.buffer[start:end].decode("utf-8")
+
+    def text_prefix(self, max_chars):
+        """Returns up to max_chars characters from the start of the corpus."""
+        # A UTF-8 character is at most 4 bytes; decode that much and trim to characters
+        return self.buffer[:max_chars * 4].decode("utf-8", errors="ignore")[:max_chars]
+
+    def text(self):
+        """Decodes the whole corpus. Avoid on large corpora; prefer chunk views or text_prefix()."""
+        return self.buffer[:].decode("utf-8")
+
+
+class CorpusDocstore(Docstore):
+    """FAISS docstore that materialises Documents from the corpus on lookup instead of storing text."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def search(self, search):
+        try:
+            return self.corpus.chunk_document(int(search))
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+
+
+def build_vector_store(corpus, embeddings, vectors=None, batch_size=64):
+    """Creates a FAISS store over the corpus chunks. Pass precomputed vectors to skip embedding."""
+    if vectors is None:
+        vectors = []
+        for start in range(0, len(corpus), batch_size):
+            vectors.extend(embeddings.embed_documents(corpus.chunks[start:start + batch_size]))
+    return vector_store_from_index(corpus, embeddings, _flat_index(vectors))
+
+
+def _flat_index(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    index = faiss.IndexFlatL2(matrix.shape[1])
+    index.add(matrix)
+    return index
+
+
+def vector_store_from_index(corpus, embeddings, index):
+    """Wraps an existing FAISS index whose row i is corpus chunk i."""
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=CorpusDocstore(corpus),
+        index_to_docstore_id={i: str(i) for i in range(index.ntotal)},
+    )
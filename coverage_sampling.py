@@ -0,0 +1,140 @@
+"""
+Chooses which text feeds the flashcard/MCQ prompts.
+
+Instead of the first N characters of the corpus, the chunk embeddings already in the
+FAISS store are clustered with k-means, and an excerpt from the chunk nearest each
+centroid fills the same character budget. The prompt therefore covers every topic
+cluster of the material at the same token cost. Clusters can be weighted towards a
+topic query or the user's starred items.
+"""
+import numpy as np
+
+GENERATION_CHAR_BUDGET = 15000
+EXCERPT_CHARS = 2500 # Target excerpt size; the budget / this gives the number of clusters
+MIN_EXCERPT_CHARS = 400
+EXCERPT_SEPARATOR = "\n\n[...]\n\n"
+
+
+def kmeans(vectors, k, iterations=25, seed=0):
+    """Spherical k-means with k-means++ seeding; returns (labels, centroids)."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    centroids = [vectors[rng.integers(n)]]
+    for _ in range(1, k):
+        distances = np.min(1.0 - vectors @ np.array(centroids).T, axis=1).clip(min=0)
+        if distances.sum() == 0:
+            break # Fewer distinct vectors than clusters
+        centroids.append(vectors[rng.choice(n, p=distances / distances.sum())])
+    centroids = np.array(centroids)
+    labels = np.zeros(n, dtype=int)
+    for iteration in range(iterations):
+        new_labels = np.argmax(vectors @ centroids.T, axis=1)
+        if iteration and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(len(centroids)):
+            members = vectors[labels == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return labels, centroids
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _excerpt(text, max_chars):
+    """Cuts text to max_chars, preferring to end at a paragraph or sentence boundary."""
+    if len(text) <= max_chars:
+        return text.strip()
+    cut = text[:max_chars]
+    boundary = max(cut.rfind("\n\n"), cut.rfind(". "))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary + 1]
+    return cut.strip()
+
+
+def select_coverage_text(vector_store, max_chars=GENERATION_CHAR_BUDGET, steer_vectors=None, steer_weight=0.6, seed=0):
+    """
+    Returns up to max_chars of representative excerpts spread across the whole corpus.
+    steer_vectors (embeddings of a topic query or starred items) shift budget towards the closest clusters.
+    """
+    index = vector_store.index
+    n = index.ntotal
+    if n == 0:
+        return ""
+    vectors = _normalize(index.reconstruct_n(0, n))
+    k = max(1, min(n, max_chars // EXCERPT_CHARS))
+    labels, centroids = kmeans(vectors, k, seed=seed)
+
+    weights = np.bincount(labels, minlength=len(centroids)).astype(np.float64)
+    weights /= weights.sum()
+    if steer_vectors is not None and len(steer_vectors):
+        relevance = (centroids @ _normalize(steer_vectors).T).max(axis=1).clip(min=0)
+        relevance = relevance ** 4 # Sharpen: cosine similarities between BGE vectors sit in a narrow band
+        if relevance.sum() > 0:
+            weights = (1 - steer_weight) * weights + steer_weight * relevance / relevance.sum()
+
+    # Budget per cluster, dropping clusters too small to yield a useful excerpt
+    order = np.argsort(-weights)
+    kept = [c for c in order if weights[c] * max_chars >= MIN_EXCERPT_CHARS] or [order[0]]
+    members_by_cluster = {c: np.flatnonzero(labels == c) for c in kept}
+    # Smallest clusters first: budget they cannot fill carries over to the larger clusters after them
+    kept.sort(key=lambda c: (len(members_by_cluster[c]), -weights[c]))
+    remaining_weight = sum(weights[c] for c in kept)
+    remaining_chars = max_chars
+
+    excerpts = []
+
+    def add_excerpt(chunk_index, budget):
+        """Appends an excerpt of the chunk within budget (separator included); returns the characters used."""
+        separator = len(EXCERPT_SEPARATOR) if excerpts else 0
+        if budget - separator < MIN_EXCERPT_CHARS:
+            return 0
+        doc = vector_store.docstore.search(vector_store.index_to_docstore_id[int(chunk_index)])
+        source = doc.metadata.get("source")
+        label = f"[{source}, page {doc.metadata['page']}]\n" if source and "page" in doc.metadata else ""
+        text = label + _excerpt(doc.page_content, budget - separator - len(label))
+        excerpts.append((int(chunk_index), text))
+        return separator + len(text)
+
+    # Representative chunks of each cluster: closest to the centroid first
+    ranked_members = {c: members[np.argsort(-(vectors[members] @ centroids[c]))] for c, members in members_by_cluster.items()}
+    for c in kept:
+        budget = int(remaining_chars * weights[c] / remaining_weight)
+        remaining_weight -= weights[c]
+        for chunk_index in ranked_members[c]:
+            used = add_excerpt(chunk_index, budget)
+            if not used:
+                break
+            budget -= used
+            remaining_chars -= used
+
+    # Budget still left (clusters with little text, trimmed excerpts) goes to chunks not used yet, by cluster weight
+    used_chunks = {chunk_index for chunk_index, _ in excerpts}
+    for c in order:
+        members = ranked_members.get(c)
+        if members is None:
+            members = np.flatnonzero(labels == c)
+            members = members[np.argsort(-(vectors[members] @ centroids[c]))]
+        for chunk_index in members:
+            if remaining_chars < MIN_EXCERPT_CHARS:
+                break
+            if int(chunk_index) not in used_chunks:
+                remaining_chars -= add_excerpt(chunk_index, remaining_chars)
+    # Keep document order so the model reads the excerpts in the same sequence as the material
+    excerpts.sort()
+    return EXCERPT_SEPARATOR.join(text for _, text in excerpts)[:max_chars]
+
+
+def get_generation_text(corpus, vector_store=None, encoder=None, focus_topic="", focus_texts=None, max_chars=GENERATION_CHAR_BUDGET):
+    """Text for the flashcard/MCQ prompts: the whole corpus if it fits, coverage-sampled when an index exists, else the corpus prefix."""
+    prefix = corpus.text_prefix(max_chars + 1)
+    if len(prefix) <= max_chars or vector_store is None or vector_store.index.ntotal == 0:
+        # A corpus that fits the budget is sent whole; sampling would only drop text
+        return prefix[:max_chars]
+    steer_texts = ([focus_topic] if focus_topic and focus_topic.strip() else []) + list(focus_texts or [])
+    steer_vectors = [encoder.encode(text) for text in steer_texts] if steer_texts and encoder else None
+    return select_coverage_text(vector_store, max_chars, steer_vectors=steer_vectors)
@@ -0,0 +1,32 @@
+import os
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders import TextLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Shared by the Streamlit app and the offline indexing CLI so both build identical indexes
+CHUNK_SIZE = 10000
+CHUNK_OVERLAP = 1000
+LOADERS_BY_EXTENSION = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+}
+
+
+def is_supported_file(file_path):
+    """Returns True if a loader exists for the file's extension."""
+    return os.path.splitext(file_path)[1].lower() in LOADERS_BY_EXTENSION
+
+
+def load_document_pages(file_path):
+    """Loads a PDF or TXT file and returns its text as a list of pages (one entry for TXT)."""
+    loader_cls = LOADERS_BY_EXTENSION.get(os.path.splitext(file_path)[1].lower())
+    if loader_cls is None:
+        raise ValueError(f"Unsupported file type: {file_path}")
+    documents = loader_cls(file_path).load()
+    return [doc.page_content for doc in documents]
+
+
+def split_document(text):
+    """Splits a document into chunks; returns (start_char, chunk_text) pairs."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    return [(doc.metadata["start_index"], doc.page_content) for doc in text_splitter.create_documents([text])]
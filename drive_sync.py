@@ -0,0 +1,237 @@
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from document_processing import is_supported_file
+try:
+    import fcntl
+except ImportError: # Windows: only the in-process lock applies
+    fcntl = None
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# Google-native files have no binary content; they are exported to formats our loaders can read
+EXPORT_FORMATS = {
+    "application/vnd.google-apps.document": ("text/plain", ".txt"),
+    "application/vnd.google-apps.presentation": ("text/plain", ".txt"),
+}
+MANIFEST_FILE = ".manifest.json"
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, modifiedTime, md5Checksum)"
+# Every session syncing the same folder shares one mirror; syncs of one mirror run one at a time
+_mirror_locks = {}
+_mirror_locks_guard = threading.Lock()
+
+
+@contextmanager
+def mirror_lock(mirror_dir):
+    """Holds the process-wide lock for a mirror, plus a file lock beside it for other worker processes."""
+    key = os.path.realpath(mirror_dir)
+    with _mirror_locks_guard:
+        lock = _mirror_locks.setdefault(key, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(key) or ".", exist_ok=True)
+        with open(key + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(target, data):
+    """Writes bytes through a uniquely named temp file in the target's folder, then swaps it into place."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except FileNotFoundError: pass
+        raise
+
+
+def safe_name(name):
+    """Makes a Drive item name usable as one local path component."""
+    name = name.replace("/", "_").replace("\\", "_").replace("\0", "_")
+    # "." and ".." would resolve outside the item's folder
+    return "_" if name.strip(".") == "" else name
+
+
+class SyncResult:
+    """Mirror-relative paths grouped by what happened to them during a sync."""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.unchanged = []
+        self.failed = [] # (path, error message)
+
+    @property
+    def delta(self):
+        """Paths whose content must be (re)processed."""
+        return self.added + self.changed
+
+
+class DriveSync:
+    """
+    Incrementally mirrors a Google Drive folder tree to a local directory.
+
+    `service_factory` returns a Drive v3 service (googleapiclient.discovery.build(...)).
+    Each download thread gets its own service, since those objects are not thread-safe.
+    Any object exposing the same files().list/get_media/export_media calls works, which
+    lets the engine run against a local fake Drive API.
+    """
+
+    def __init__(self, service_factory, mirror_dir, max_workers=4):
+        self.service_factory = service_factory
+        self.mirror_dir = mirror_dir
+        self.max_workers = max_workers
+        self._local = threading.local()
+
+    def _service(self):
+        if not hasattr(self._local, "service"):
+            self._local.service = self.service_factory()
+        return self._local.service
+
+    # --- Manifest ---
+    def _manifest_path(self):
+        return os.path.join(self.mirror_dir, MANIFEST_FILE)
+
+    def load_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        atomic_write(self._manifest_path(), json.dumps(manifest, indent=2).encode("utf-8"))
+
+    # --- Listing ---
+    def list_files(self, folder_id):
+        """Recursively lists the folder tree; returns file dicts with a mirror-relative 'path'."""
+        listed = []
+        pending_folders = [(folder_id, "")]
+        while pending_folders:
+            current_id, prefix = pending_folders.pop()
+            page_token = None
+            while True:
+                response = self._service().files().list(
+                    q=f"'{current_id}' in parents and trashed = false",
+                    fields=LIST_FIELDS,
+                    pageSize=1000,
+                    pageToken=page_token,
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
+                ).execute()
+                for item in response.get("files", []):
+                    name = safe_name(item["name"])
+                    if item["mimeType"] == FOLDER_MIME_TYPE:
+                        pending_folders.append((item["id"], os.path.join(prefix, name)))
+                        continue
+                    if item["mimeType"] in EXPORT_FORMATS:
+                        name += EXPORT_FORMATS[item["mimeType"]][1]
+                    if not is_supported_file(name):
+                        continue
+                    listed.append(dict(item, path=os.path.join(prefix, name)))
+                page_token = response.get("nextPageToken")
+                if not page_token:
+                    break
+        # Drive allows duplicate names in one folder; keep mirror paths unique
+        seen = set()
+        for item in sorted(listed, key=lambda i: (i["path"], i["id"])):
+            if item["path"] in seen:
+                stem, ext = os.path.splitext(item["path"])
+                item["path"] = f"{stem}__{item['id']}{ext}"
+            seen.add(item["path"])
+        return listed
+
+    def _mirror_path(self, path):
+        """Absolute path of a mirror-relative path; raises ValueError if it would escape the mirror."""
+        root = os.path.realpath(self.mirror_dir)
+        target = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, target]) != root or target == root:
+            raise ValueError(f"Refusing path outside the mirror: {path!r}")
+        return target
+
+    def _remove(self, path):
+        try: os.remove(self._mirror_path(path))
+        except (FileNotFoundError, ValueError): pass
+
+    # --- Sync ---
+    @staticmethod
+    def _is_unchanged(item, entry):
+        if entry is None or entry.get("path") != item["path"]:
+            return False
+        # Binary files carry an md5; Google-native files only have a modification time
+        if item.get("md5Checksum"):
+            return entry.get("md5Checksum") == item["md5Checksum"]
+        return entry.get("modifiedTime") == item.get("modifiedTime")
+
+    def _download(self, item):
+        files = self._service().files()
+        if item["mimeType"] in EXPORT_FORMATS:
+            content = files.export_media(fileId=item["id"], mimeType=EXPORT_FORMATS[item["mimeType"]][0]).execute()
+        else:
+            content = files.get_media(fileId=item["id"], supportsAllDrives=True).execute()
+        target = self._mirror_path(item["path"])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        atomic_write(target, content)
+
+    def sync(self, folder_id):
+        """Brings the mirror up to date, downloading only new or changed files. Waits for other syncs of the same mirror."""
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        with mirror_lock(self.mirror_dir):
+            return self._sync(folder_id)
+
+    def _sync(self, folder_id):
+        manifest = self.load_manifest()
+        if manifest.get("folder_id") != folder_id:
+            manifest = {"folder_id": folder_id, "files": {}}
+        known = manifest["files"]
+        result = SyncResult()
+
+        listed = self.list_files(folder_id)
+        to_download = []
+        for item in listed:
+            entry = known.get(item["id"])
+            if self._is_unchanged(item, entry) and os.path.exists(os.path.join(self.mirror_dir, item["path"])):
+                result.unchanged.append(item["path"])
+            else:
+                to_download.append((item, "added" if entry is None else "changed"))
+
+        listed_ids = {item["id"] for item in listed}
+        # Paths of listed files; a stale copy is only deleted if no other file has taken over its path
+        claimed_paths = {item["path"] for item in listed}
+        for file_id in [fid for fid in known if fid not in listed_ids]:
+            path = known.pop(file_id)["path"]
+            if path not in claimed_paths:
+                self._remove(path)
+            result.removed.append(path)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._download, item): (item, status) for item, status in to_download}
+                for future in as_completed(futures):
+                    item, status = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        result.failed.append((item["path"], str(e)))
+                        continue
+                    old_entry = known.get(item["id"])
+                    if old_entry and old_entry["path"] != item["path"] and old_entry["path"] not in claimed_paths:
+                        # Renamed or moved: drop the stale copy
+                        self._remove(old_entry["path"])
+                    known[item["id"]] = {key: item.get(key) for key in ("path", "mimeType", "modifiedTime", "md5Checksum")}
+                    getattr(result, status).append(item["path"])
+        finally:
+            # Persist whatever finished, so an interrupted sync does not re-download it
+            self._save_manifest(manifest)
+        return result
@@ -0,0 +1,153 @@
+"""
+Selectable CPU embedding engines for the BGE model.
+
+    torch      sentence-transformers in fp32 PyTorch (the original behaviour)
+    onnx       the same model exported to ONNX Runtime
+    onnx-int8  ONNX Runtime with dynamic int8 quantization (exported once, then cached on disk)
+    remote     a shared embedding_server.py process at `cerebro_embedding_server_url`
+
+Pick one with the `cerebro_embedding_engine` environment variable. To see how an
+engine compares with the fp32 baseline on this machine, run:
+
+    python embedding_engines.py --engine onnx-int8
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import streamlit as st
+from langchain_huggingface import HuggingFaceEmbeddings
+
+EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
+DEFAULT_ENGINE = "torch"
+EMBEDDING_ENGINE = os.getenv("cerebro_embedding_engine", DEFAULT_ENGINE)
+# Instruction set targeted by the int8 export: one of "arm64", "avx2", "avx512", "avx512_vnni"
+QUANTIZATION_CONFIG = os.getenv("cerebro_quantization_config", "avx2")
+EMBEDDING_SERVER_URL = os.getenv("cerebro_embedding_server_url", "http://127.0.0.1:8765")
+ONNX_CACHE_DIR = os.getenv("cerebro_onnx_cache_dir", os.path.join(os.path.expanduser("~"), ".cache", "cerebro", "onnx"))
+
+
+def load_torch_engine(model_name):
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def load_onnx_engine(model_name):
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"backend": "onnx"})
+
+
+def export_quantized_model(model_name, quantization_config=QUANTIZATION_CONFIG):
+    """Exports a dynamically int8-quantized ONNX copy of the model once; returns (model_dir, onnx_file)."""
+    model_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "__"))
+    onnx_file = os.path.join("onnx", f"model_qint8_{quantization_config}.onnx")
+    if not os.path.exists(os.path.join(model_dir, onnx_file)):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+        SentenceTransformer(model_name).save(model_dir) # Tokenizer, pooling and config next to the ONNX files
+        onnx_model = SentenceTransformer(model_dir, backend="onnx")
+        export_dynamic_quantized_onnx_model(onnx_model, quantization_config, model_dir)
+    return model_dir, onnx_file
+
+
+def load_onnx_int8_engine(model_name):
+    model_dir, onnx_file = export_quantized_model(model_name)
+    return HuggingFaceEmbeddings(
+        model_name=model_dir,
+        model_kwargs={"backend": "onnx", "model_kwargs": {"file_name": onnx_file}},
+    )
+
+
+def load_remote_engine(model_name):
+    # Imported here: the server module itself loads local engines from this module
+    from embedding_server import RemoteEmbeddings
+    return RemoteEmbeddings(EMBEDDING_SERVER_URL)
+
+
+# Engine name -> loader returning a LangChain Embeddings object
+EMBEDDING_ENGINES = {
+    "torch": load_torch_engine,
+    "onnx": load_onnx_engine,
+    "onnx-int8": load_onnx_int8_engine,
+    "remote": load_remote_engine,
+}
+
+
+def engine_settings(engine=None):
+    """Settings besides the engine name that change the vectors it produces; recorded with indexes built by it."""
+    engine = engine or EMBEDDING_ENGINE
+    return {"quantization_config": QUANTIZATION_CONFIG} if engine == "onnx-int8" else {}
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL_NAME, engine=None):
+    """Loads the embedding model with the configured engine."""
+    engine = engine or EMBEDDING_ENGINE
+    if engine not in EMBEDDING_ENGINES:
+        raise ValueError(f"Unknown embedding engine '{engine}'. Choose one of: {', '.join(EMBEDDING_ENGINES)}")
+    return EMBEDDING_ENGINES[engine](model_name)
+
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_model(model_name=EMBEDDING_MODEL_NAME, engine=None):
+    """Returns one embedding model per process, shared by every session."""
+    return load_embedding_model(model_name, engine)
+
+
+# --- Parity Check ---
+PARITY_SAMPLE_TEXTS = [
+    "The derivative of a function measures how its output changes as its input changes.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "A hash table maps keys to values using a hash function to compute an index.",
+    "The French Revolution began in 1789 and reshaped European politics.",
+    "Newton's second law states that force equals mass times acceleration.",
+    "Supply and demand determine the equilibrium price in a competitive market.",
+    "Mitochondria produce most of the cell's supply of adenosine triphosphate.",
+    "An eigenvector of a matrix is only scaled, not rotated, when the matrix is applied.",
+]
+
+
+def _timed_embed(embeddings, texts, repeats):
+    embeddings.embed_documents(texts[:1]) # Warm-up, so lazy initialisation is not timed
+    start = time.perf_counter()
+    for _ in range(repeats):
+        vectors = embeddings.embed_documents(texts)
+    return np.asarray(vectors, dtype=np.float32), (time.perf_counter() - start) / repeats
+
+
+def check_engine_parity(engine, texts=None, model_name=EMBEDDING_MODEL_NAME, repeats=3):
+    """Compares an engine with the fp32 torch baseline; returns cosine agreement and speedup."""
+    texts = texts or PARITY_SAMPLE_TEXTS
+    baseline_vectors, baseline_seconds = _timed_embed(load_embedding_model(model_name, "torch"), texts, repeats)
+    engine_vectors, engine_seconds = _timed_embed(load_embedding_model(model_name, engine), texts, repeats)
+    cosines = np.sum(baseline_vectors * engine_vectors, axis=1) / (
+        np.linalg.norm(baseline_vectors, axis=1) * np.linalg.norm(engine_vectors, axis=1))
+    return {
+        "engine": engine,
+        "num_texts": len(texts),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "baseline_seconds": baseline_seconds,
+        "engine_seconds": engine_seconds,
+        "speedup": baseline_seconds / engine_seconds if engine_seconds else float("inf"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check an embedding engine against the fp32 torch baseline.")
+    parser.add_argument("--engine", default=EMBEDDING_ENGINE, choices=sorted(EMBEDDING_ENGINES))
+    parser.add_argument("--texts-from", help="Optional text file; each non-empty line is used as a sample.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Fail if any sample agrees less than this.")
+    args = parser.parse_args(argv)
+    texts = None
+    if args.texts_from:
+        with open(args.texts_from, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    report = check_engine_parity(args.engine, texts, repeats=args.repeats)
+    print(f"Engine:          {report['engine']} ({report['num_texts']} texts)")
+    print(f"Cosine vs fp32:  mean {report['mean_cosine']:.5f}, min {report['min_cosine']:.5f}")
+    print(f"Time per batch:  fp32 {report['baseline_seconds']:.3f}s, {report['engine']} {report['engine_seconds']:.3f}s")
+    print(f"Speedup:         {report['speedup']:.2f}x")
+    return 0 if report["min_cosine"] >= args.min_cosine else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Shared local embedding server.
+
+Holds one copy of the embedding model per host and dynamically batches requests
+from every Streamlit worker process. Start it once:
+
+    python embedding_server.py --port 8765 --engine onnx-int8
+
+then run the workers with:
+
+    cerebro_embedding_engine=remote cerebro_embedding_server_url=http://127.0.0.1:8765
+
+Endpoints:
+    POST /embed    {"texts": [...]} -> {"embeddings": [[...], ...]}
+    GET  /metrics  queue depth, batch sizes and request counters
+    GET  /health
+When the queue is full, /embed answers 503 with a Retry-After header and the client backs off.
+A request with more texts than the whole queue holds can never fit and gets 413 instead.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.embeddings import Embeddings
+from micro_batcher import MicroBatcher, QueueFullError
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+RETRY_AFTER_SECONDS = 1
+
+
+class EmbeddingService:
+    """The model, its batcher and request counters; shared by all HTTP handler threads."""
+
+    def __init__(self, embeddings, batch_window=0.005, max_batch_size=64, max_queue_size=2048, request_timeout=300):
+        self.embeddings = embeddings
+        self.request_timeout = request_timeout
+        self.batcher = MicroBatcher(embeddings.embed_documents, batch_window, max_batch_size, max_queue_size, name="embedding-server")
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "rejected_requests": 0, "oversized_requests": 0, "failed_requests": 0, "texts": 0, "request_seconds": 0.0}
+        self.started_at = time.time()
+
+    def embed(self, texts):
+        started = time.perf_counter()
+        try:
+            futures = self.batcher.submit_many(texts)
+        except QueueFullError:
+            self._count(rejected_requests=1)
+            raise
+        try:
+            vectors = [future.result(timeout=self.request_timeout) for future in futures]
+        except Exception:
+            self._count(failed_requests=1)
+            raise
+        self._count(requests=1, texts=len(texts), request_seconds=time.perf_counter() - started)
+        return vectors
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+        batcher_stats = dict(self.batcher.stats)
+        return dict(
+            counters,
+            queue_depth=self.batcher.queue_depth,
+            max_queue_size=self.batcher.max_queue_size,
+            batches=batcher_stats["batches"],
+            rejected_texts=batcher_stats["rejected"],
+            avg_batch_size=batcher_stats["batched_items"] / batcher_stats["batches"] if batcher_stats["batches"] else 0.0,
+            avg_request_seconds=counters["request_seconds"] / counters["requests"] if counters["requests"] else 0.0,
+            uptime_seconds=time.time() - self.started_at,
+        )
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    service = None # Set on the subclass created by make_server()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send_json(200, self.service.metrics())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            texts = payload["texts"]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("'texts' must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Bad request: {e}"})
+            return
+        max_texts = self.service.batcher.max_queue_size
+        if max_texts and len(texts) > max_texts:
+            # Would be rejected even by an empty queue, so a 503 retry could never succeed
+            self.service._count(oversized_requests=1)
+            self._send_json(413, {"error": f"Too many texts in one request ({len(texts)} > {max_texts}); split it into smaller requests.",
+                                  "max_texts": max_texts})
+            return
+        try:
+            vectors = self.service.embed(texts)
+        except QueueFullError as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"Embedding failed: {e}"})
+            return
+        self._send_json(200, {"embeddings": vectors})
+
+    def log_message(self, format, *args):
+        pass # Per-request logging would swamp the console; use /metrics instead
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type("BoundEmbeddingRequestHandler", (EmbeddingRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class RemoteEmbeddings(Embeddings):
+    """LangChain Embeddings that call a shared embedding server instead of loading the model in-process."""
+
+    def __init__(self, url, timeout=300, max_retries=6, request_batch_size=256):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.request_batch_size = request_batch_size
+
+    def _post(self, texts):
+        data = json.dumps({"texts": texts}).encode("utf-8")
+        for attempt in range(self.max_retries + 1):
+            request = urllib.request.Request(f"{self.url}/embed", data=data, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())["embeddings"]
+            except urllib.error.HTTPError as e:
+                # Only 503 (queue busy) is worth retrying; 413 (request larger than the queue) never succeeds
+                if e.code != 503 or attempt == self.max_retries:
+                    hint = " Lower request_batch_size or raise the server's --max-queue." if e.code == 413 else ""
+                    raise RuntimeError(f"Embedding server error {e.code}: {e.read().decode('utf-8', 'replace')}{hint}") from e
+                # Backpressure: wait as asked, plus jitter so workers do not retry in lockstep
+                delay = float(e.headers.get("Retry-After", RETRY_AFTER_SECONDS)) * (2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+
+    def embed_documents(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.request_batch_size):
+            vectors.extend(self._post(list(texts[start:start + self.request_batch_size])))
+        return vectors
+
+    def embed_query(self, text):
+        return self._post([text])[0]
+
+
+def main(argv=None):
+    from embedding_engines import EMBEDDING_MODEL_NAME, EMBEDDING_ENGINES, load_embedding_model
+    local_engines = sorted(name for name in EMBEDDING_ENGINES if name != "remote")
+    parser = argparse.ArgumentParser(description="Serve one shared embedding model to all Cerebro workers on this host.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--engine", default="torch", choices=local_engines)
+    parser.add_argument("--batch-window", type=float, default=0.005, help="Seconds to wait for more texts before embedding a batch.")
+    parser.add_argument("--max-batch", type=int, default=64, help="Maximum texts per forward pass.")
+    parser.add_argument("--max-queue", type=int, default=2048, help="Queued texts before requests are rejected with 503.")
+    args = parser.parse_args(argv)
+
+    print(f"Loading {EMBEDDING_MODEL_NAME} ({args.engine})...")
+    service = EmbeddingService(load_embedding_model(EMBEDDING_MODEL_NAME, args.engine),
+                               batch_window=args.batch_window, max_batch_size=args.max_batch, max_queue_size=args.max_queue)
+    server = make_server(service, args.host, args.port)
+    print(f"Embedding server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
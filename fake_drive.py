@@ -0,0 +1,129 @@
+"""
+In-memory stand-in for the Drive v3 files() API, for exercising DriveSync without Google.
+
+    drive = FakeDrive()
+    folder = drive.add_folder("Course")
+    drive.add_file("notes.txt", b"...", parent=folder)
+    DriveSync(lambda: drive, mirror_dir).sync(folder)
+"""
+import re
+import hashlib
+import itertools
+import threading
+from datetime import datetime, timedelta, timezone
+from drive_sync import FOLDER_MIME_TYPE, EXPORT_FORMATS
+
+_PARENT_QUERY = re.compile(r"'([^']+)' in parents")
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self):
+        return self._run()
+
+
+class FakeFiles:
+    """The subset of files() that DriveSync calls: list, get_media and export_media."""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q, pageSize=100, pageToken=None, **kwargs):
+        def run():
+            self.drive.calls["list"] += 1
+            parent = _PARENT_QUERY.search(q).group(1)
+            children = [f for f in self.drive.items.values() if parent in f["parents"] and not f["trashed"]]
+            start = int(pageToken or 0)
+            page = children[start:start + min(pageSize, self.drive.page_size)]
+            response = {"files": [self.drive.metadata(f["id"]) for f in page]}
+            if start + len(page) < len(children):
+                response["nextPageToken"] = str(start + len(page))
+            return response
+        return FakeRequest(run)
+
+    def get_media(self, fileId, **kwargs):
+        def run():
+            item = self.drive.fetch(fileId)
+            if item["mimeType"] in EXPORT_FORMATS or item["mimeType"] == FOLDER_MIME_TYPE:
+                raise ValueError(f"Only files with binary content can be downloaded: {fileId}")
+            return item["content"]
+        return FakeRequest(run)
+
+    def export_media(self, fileId, mimeType, **kwargs):
+        def run():
+            item = self.drive.fetch(fileId)
+            if EXPORT_FORMATS.get(item["mimeType"], (None,))[0] != mimeType:
+                raise ValueError(f"Export to {mimeType} not supported for {fileId}")
+            return item["content"]
+        return FakeRequest(run)
+
+
+class FakeDrive:
+    """
+    A Drive holding folders and files in memory. Binary files get an md5Checksum,
+    Google-native files (Docs, Slides) only a modifiedTime, as on the real API.
+    Ids listed in `failing` raise on download.
+    """
+
+    def __init__(self, page_size=100):
+        self.items = {}
+        self.page_size = page_size
+        self.failing = set()
+        self.calls = {"list": 0, "download": 0}
+        self._lock = threading.Lock() # DriveSync downloads from several threads
+        self._ids = itertools.count(1)
+        self._clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def files(self):
+        return FakeFiles(self)
+
+    def _tick(self):
+        self._clock += timedelta(seconds=1)
+        return self._clock.isoformat().replace("+00:00", "Z")
+
+    # --- Mutations ---
+    def add_folder(self, name, parent=None):
+        return self._add(name, FOLDER_MIME_TYPE, b"", parent)
+
+    def add_file(self, name, content, parent=None, mime_type="text/plain"):
+        return self._add(name, mime_type, content, parent)
+
+    def _add(self, name, mime_type, content, parent):
+        file_id = f"id{next(self._ids)}"
+        self.items[file_id] = {"id": file_id, "name": name, "mimeType": mime_type, "content": content,
+                               "parents": [parent] if parent else [], "trashed": False, "modifiedTime": self._tick()}
+        return file_id
+
+    def update(self, file_id, content=None, name=None, parent=None):
+        item = self.items[file_id]
+        if content is not None:
+            item["content"] = content
+        if name is not None:
+            item["name"] = name
+        if parent is not None:
+            item["parents"] = [parent]
+        item["modifiedTime"] = self._tick()
+
+    def touch(self, file_id):
+        """Bumps modifiedTime without changing content, like opening and saving a file."""
+        self.items[file_id]["modifiedTime"] = self._tick()
+
+    def trash(self, file_id):
+        self.items[file_id]["trashed"] = True
+
+    # --- Reads ---
+    def metadata(self, file_id):
+        item = self.items[file_id]
+        metadata = {key: item[key] for key in ("id", "name", "mimeType", "modifiedTime")}
+        if item["mimeType"] != FOLDER_MIME_TYPE and item["mimeType"] not in EXPORT_FORMATS:
+            metadata["md5Checksum"] = hashlib.md5(item["content"]).hexdigest()
+        return metadata
+
+    def fetch(self, file_id):
+        with self._lock:
+            self.calls["download"] += 1
+        if file_id in self.failing:
+            raise IOError(f"Simulated download failure for {file_id}")
+        return self.items[file_id]
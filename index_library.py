@@ -0,0 +1,105 @@
+import os
+import json
+import re
+import shutil
+import tempfile
+from datetime import datetime, timezone
+import faiss
+from corpus_store import Corpus, vector_store_from_index
+from summary_index import SummaryIndex
+
+# Where prebuilt index bundles live: <library>/<name>/v0001/, v0002/, ...
+INDEX_LIBRARY_DIR = os.getenv("cerebro_index_dir", "indexes")
+BUNDLE_METADATA_FILE = "bundle.json"
+FAISS_INDEX_FILE = "index.faiss"
+# Bumped when the on-disk layout changes; older bundles must be rebuilt
+BUNDLE_FORMAT = 2
+_VERSION_DIR_PATTERN = re.compile(r"^v(\d{4,})$")
+
+
+def _bundle_versions(bundle_root, complete_only=True):
+    """Returns the sorted version numbers that exist under a bundle name (by default only complete ones)."""
+    if not os.path.isdir(bundle_root): return []
+    versions = []
+    for entry in os.listdir(bundle_root):
+        match = _VERSION_DIR_PATTERN.match(entry)
+        if match and (not complete_only or os.path.exists(os.path.join(bundle_root, entry, BUNDLE_METADATA_FILE))):
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+def _write_json(path, data):
+    # Write-then-rename, so readers never see a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_index_bundle(vector_store, corpus, name, metadata, library_dir=INDEX_LIBRARY_DIR, summary_index=None):
+    """
+    Writes a new version of the named bundle and returns its directory.
+    Everything is written to a temporary folder that is renamed to vNNNN at the end, so an
+    interrupted build never leaves a partial version behind.
+    """
+    bundle_root = os.path.join(library_dir, name)
+    os.makedirs(bundle_root, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=bundle_root, prefix=".building-")
+    try:
+        # The corpus holds the only copy of the text; the FAISS index row i is corpus chunk i
+        corpus.save(build_dir)
+        faiss.write_index(vector_store.index, os.path.join(build_dir, FAISS_INDEX_FILE))
+        if summary_index is not None:
+            summary_index.save(build_dir)
+        created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        while True:
+            # Numbered after every vNNNN folder, complete or not, so a leftover folder is never reused
+            versions = _bundle_versions(bundle_root, complete_only=False)
+            version = (versions[-1] + 1) if versions else 1
+            _write_json(os.path.join(build_dir, BUNDLE_METADATA_FILE), dict(
+                metadata, name=name, version=version, bundle_format=BUNDLE_FORMAT, created_at=created_at))
+            bundle_dir = os.path.join(bundle_root, f"v{version:04d}")
+            try:
+                os.rename(build_dir, bundle_dir)
+                return bundle_dir
+            except OSError:
+                if not os.path.exists(bundle_dir): raise
+                # Another build took this number in the meantime; try the next one
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+
+def latest_index_bundle(name, library_dir=INDEX_LIBRARY_DIR):
+    """Returns metadata (with its 'path') of the latest readable version of a bundle, or None if it has none."""
+    for version in reversed(_bundle_versions(os.path.join(library_dir, name))):
+        bundle_dir = os.path.join(library_dir, name, f"v{version:04d}")
+        try:
+            with open(os.path.join(bundle_dir, BUNDLE_METADATA_FILE), encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue # Damaged or unreadable metadata; fall back to the previous version
+        metadata["path"] = bundle_dir
+        return metadata
+    return None
+
+
+def list_index_bundles(library_dir=INDEX_LIBRARY_DIR):
+    """Returns metadata for the latest complete version of every bundle in the library."""
+    if not os.path.isdir(library_dir): return []
+    bundles = []
+    for name in sorted(os.listdir(library_dir)):
+        metadata = latest_index_bundle(name, library_dir)
+        if metadata: bundles.append(metadata)
+    return bundles
+
+
+def load_index_bundle(bundle_dir, embeddings):
+    """Loads a bundle and returns (vector_store, corpus, summary_index, metadata). The corpus text is memory-mapped."""
+    with open(os.path.join(bundle_dir, BUNDLE_METADATA_FILE), encoding="utf-8") as f:
+        metadata = json.load(f)
+    if metadata.get("bundle_format") != BUNDLE_FORMAT:
+        raise ValueError(f"Bundle '{metadata.get('name')}' uses an older format; rebuild it with build_index.py.")
+    corpus = Corpus.load(bundle_dir)
+    index = faiss.read_index(os.path.join(bundle_dir, FAISS_INDEX_FILE))
+    return vector_store_from_index(corpus, embeddings, index), corpus, SummaryIndex.load(bundle_dir), metadata
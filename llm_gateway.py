@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import openai
+import streamlit as st
+from langchain_openai import ChatOpenAI
+
+# Limits are per process; set them a little below the provider's account limits
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("cerebro_llm_rpm", "60"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("cerebro_llm_tpm", "1000000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("cerebro_llm_concurrency", "8"))
+LLM_MAX_RETRIES = int(os.getenv("cerebro_llm_max_retries", "4"))
+
+
+class GatewayError(Exception):
+    """An upstream LLM failure with a message that is safe to show to students."""
+
+
+def make_chat_model(api_key, base_url, model_name, temperature):
+    """Builds the DeepSeek chat model. Retries are left to the gateway, so the client does not retry on its own."""
+    return ChatOpenAI(
+        openai_api_key=api_key,
+        openai_api_base=base_url.removesuffix('/v1').removesuffix('/'),
+        model=model_name,
+        temperature=temperature,
+        max_retries=0,
+    )
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.capacity = capacity or per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Waits until `amount` units are available and takes them; returns True if it had to wait."""
+        amount = min(amount, self.capacity) # A single oversized request must still be able to pass eventually
+        waited = False
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return waited
+            waited = True
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _friendly_message(error):
+    if isinstance(error, openai.RateLimitError):
+        return "The AI provider is rate limiting requests right now. Please wait a minute and try again."
+    if _is_retryable(error):
+        return "The AI provider is temporarily unavailable. Please try again shortly."
+    if isinstance(error, openai.AuthenticationError):
+        return "The AI provider rejected the API key. Check the DeepSeek configuration on the Home Page."
+    return f"LLM request failed: {error}"
+
+
+class LLMGateway:
+    """
+    In-process gateway in front of ChatOpenAI calls, shared by every session.
+    Identical in-flight requests are coalesced into one upstream call, requests and
+    tokens per minute are rate limited, concurrency is bounded, and 429/5xx errors
+    are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 base_delay=1.0, max_delay=30.0, completion_token_estimate=2048):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_token_estimate = completion_token_estimate
+        self.counters = {
+            "requests": 0, "coalesced": 0, "upstream_calls": 0, "retries": 0, "failures": 0,
+            "rate_limited_waits": 0, "in_flight": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+        }
+        self.usage_by_tag = {} # prompt template tag -> token counters, see prompt_registry
+        self._in_flight = {}
+        # All gateway state is only touched from this loop's thread
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True)
+        self._thread.start()
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    # --- Public API ---
+    def invoke(self, model, prompt, tag=None, timeout=None):
+        """Thread-safe blocking call; returns the model's message or raises GatewayError. `tag` groups token usage."""
+        return asyncio.run_coroutine_threadsafe(self.ainvoke(model, prompt, tag), self._loop).result(timeout)
+
+    def invoke_many(self, model, prompts, tag=None, timeout=None):
+        """
+        Runs many prompts concurrently (within the gateway's limits); returns results in order.
+        A failed prompt's slot holds its GatewayError instead of a response, so one failure neither
+        aborts the batch nor discards the calls that succeeded.
+        """
+        async def gather():
+            return await asyncio.gather(*(self.ainvoke(model, prompt, tag) for prompt in prompts), return_exceptions=True)
+        return asyncio.run_coroutine_threadsafe(gather(), self._loop).result(timeout)
+
+    async def ainvoke(self, model, prompt, tag=None):
+        self.counters["requests"] += 1
+        key = self._request_key(model, prompt)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_upstream(model, prompt, tag))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _, key=key: self._in_flight.pop(key, None))
+        else:
+            self.counters["coalesced"] += 1
+        # Shielded so one caller giving up does not cancel the call for everyone else sharing it
+        return await asyncio.shield(task)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["cache_hit_rate"] = stats["cached_prompt_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        return stats
+
+    def usage_stats(self):
+        return {tag: dict(usage) for tag, usage in self.usage_by_tag.items()}
+
+    # --- Internals ---
+    @staticmethod
+    def _request_key(model, prompt):
+        if isinstance(prompt, str):
+            serialized_prompt = prompt
+        else:
+            serialized_prompt = json.dumps([(message.type, message.content) for message in prompt])
+        identity = json.dumps([model.model_name, model.temperature, model.openai_api_base, serialized_prompt])
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _estimate_prompt_tokens(prompt):
+        text = prompt if isinstance(prompt, str) else "".join(str(message.content) for message in prompt)
+        return len(text) // 4 + 1 # ~4 characters per token is close enough for rate limiting
+
+    async def _call_upstream(self, model, prompt, tag=None):
+        estimated_tokens = self._estimate_prompt_tokens(prompt) + self.completion_token_estimate
+        for attempt in range(self.max_retries + 1):
+            waited = await self._request_bucket.acquire(1)
+            waited = await self._token_bucket.acquire(estimated_tokens) or waited
+            if waited:
+                self.counters["rate_limited_waits"] += 1
+            async with self._semaphore:
+                self.counters["upstream_calls"] += 1
+                self.counters["in_flight"] += 1
+                started = time.monotonic()
+                try:
+                    response = await model.ainvoke(prompt)
+                except Exception as e:
+                    error = e
+                else:
+                    self._record_usage(response, tag, time.monotonic() - started)
+                    return response
+                finally:
+                    self.counters["in_flight"] -= 1
+            if not _is_retryable(error) or attempt == self.max_retries:
+                self.counters["failures"] += 1
+                raise GatewayError(_friendly_message(error)) from error
+            self.counters["retries"] += 1
+            # Full jitter keeps many sessions from retrying in lockstep; honour Retry-After when given
+            backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+            await asyncio.sleep(max(_retry_after(error) or 0.0, random.uniform(0, backoff)))
+
+    def _record_usage(self, response, tag, seconds):
+        usage = token_usage(response)
+        self.counters["prompt_tokens"] += usage["prompt_tokens"]
+        self.counters["cached_prompt_tokens"] += usage["cached_prompt_tokens"]
+        self.counters["completion_tokens"] += usage["completion_tokens"]
+        tag_usage = self.usage_by_tag.setdefault(tag or "untagged", {
+            "calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0})
+        tag_usage["calls"] += 1
+        tag_usage["seconds"] += seconds
+        for key in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens"):
+            tag_usage[key] += usage[key]
+
+
+def token_usage(response):
+    """Prompt, cached-prompt and completion token counts of a chat response."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    token_details = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    # DeepSeek reports prefix-cache hits as prompt_cache_hit_tokens; OpenAI-style APIs as input_token_details.cache_read
+    cached = token_details.get("prompt_cache_hit_tokens")
+    if cached is None:
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    return {
+        "prompt_tokens": usage.get("input_tokens", token_details.get("prompt_tokens", 0)),
+        "cached_prompt_tokens": cached or 0,
+        "completion_tokens": usage.get("output_tokens", token_details.get("completion_tokens", 0)),
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_gateway():
+    """Returns the process-wide LLM gateway shared by all pages and sessions."""
+    return LLMGateway()
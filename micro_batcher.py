@@ -0,0 +1,79 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+
+class QueueFullError(Exception):
+    """Raised when the batcher's queue cannot take more work (backpressure)."""
+
+
+class MicroBatcher:
+    """
+    Groups texts submitted from many threads into batched embed calls.
+    A background thread takes the first queued text, waits up to `batch_window`
+    seconds for more (at most `max_batch_size`), and embeds them in one call.
+    With `max_queue_size` > 0, submissions beyond that depth are rejected.
+    """
+
+    def __init__(self, embed_fn, batch_window=0.01, max_batch_size=32, max_queue_size=0, name="micro-batcher"):
+        self.embed_fn = embed_fn
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "batches": 0, "batched_items": 0, "embed_seconds": 0.0}
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, text):
+        return self.submit_many([text])[0]
+
+    def submit_many(self, texts):
+        """Queues texts for embedding and returns one Future per text. All-or-nothing under backpressure."""
+        with self._submit_lock:
+            if self.max_queue_size and self._queue.qsize() + len(texts) > self.max_queue_size:
+                self.stats["rejected"] += len(texts)
+                raise QueueFullError(f"Embedding queue full ({self._queue.qsize()}/{self.max_queue_size} texts waiting)")
+            futures = []
+            for text in texts:
+                future = Future()
+                self._queue.put((text, future))
+                futures.append(future)
+            self.stats["submitted"] += len(texts)
+        return futures
+
+    def _collect_batch(self):
+        # Block for the first text, then gather whatever else arrives within the window
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            try:
+                vectors = self.embed_fn([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats["embed_seconds"] += time.perf_counter() - started
+            self.stats["batches"] += 1
+            self.stats["batched_items"] += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+from embedding_engines import EMBEDDING_MODEL_NAME, get_embedding_model
+from micro_batcher import MicroBatcher
+
+
+class QueryEncoder:
+    """
+    Encodes chat queries with an LRU cache and micro-batching.
+    Concurrent encode() calls arriving within `batch_window` seconds are
+    embedded together in a single forward pass on a background thread.
+    """
+
+    def __init__(self, embeddings, max_cache_size=1024, batch_window=0.01, max_batch_size=32):
+        self.embeddings = embeddings
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        self._in_flight = {} # normalized query -> Future, so duplicates share one slot in a batch
+        self._lock = threading.RLock() # Re-entrant: a future may already be done when its callback is added
+        self._batcher = MicroBatcher(embeddings.embed_documents, batch_window, max_batch_size, name="query-encoder")
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def normalize_query(query):
+        """Collapses whitespace and case so trivially different queries share a cache entry."""
+        return " ".join(query.split()).lower()
+
+    def encode(self, query, timeout=None):
+        """Returns the embedding for `query`, from cache or the next micro-batch."""
+        key = self.normalize_query(query)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._cache[key]
+            self.stats["misses"] += 1
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._batcher.submit(key)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return future.result(timeout=timeout)
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+
+
+@st.cache_resource(show_spinner=False)
+def get_query_encoder(model_name=EMBEDDING_MODEL_NAME):
+    """Returns the process-wide query encoder shared across chat sessions."""
+    return QueryEncoder(get_embedding_model(model_name))
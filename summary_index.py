@@ -0,0 +1,263 @@
+"""
+Hierarchical summary index for broad questions.
+
+Built once after ingestion:
+
+    section summaries    one per SECTION_CHUNKS consecutive chunks of a document (summarised in parallel)
+    document summaries   one per document, combined from its section summaries
+    corpus summary       one overall summary when there is more than one document
+
+At query time, route_query() answers broad questions ("summarize chapter 3", "what are
+the main topics") from summary nodes instead of five raw 10k-character chunks, when the
+named part can be found or the summaries match the question at least as well as the
+best leaf chunk. Other questions use the leaf chunks.
+"""
+import os
+import re
+import json
+import numpy as np
+from langchain_core.documents import Document
+from prompt_registry import build_messages, prompt_tag
+
+SECTION_CHUNKS = 2
+SUMMARY_CONTEXT_CHARS = 8000
+SUMMARIES_FILE = "summaries.json"
+SUMMARY_VECTORS_FILE = "summary_vectors.npy"
+
+PART_WORDS = r"chapter|section|unit|lecture|module|week|part"
+MATERIAL_WORDS = r"documents?|notes|chapters?|lectures?|material|book|course|slides"
+# Questions about the material as a whole, or about a large part of it. "Outline" and "main/key points"
+# only count with no object or with the material as object ("key points of entropy" is a specific question).
+BROAD_QUESTION_PATTERN = re.compile(
+    rf"\b(summar(y|ise|ize|ies)|overview|recap|gist|"
+    rf"outline(?=\s*[?.!]*$| of (this|these|the|each|all) ({MATERIAL_WORDS})\b| ({PART_WORDS}) \w+)|"
+    rf"(main|key) (topics?|ideas?|points?|themes?|takeaways?|concepts?)(?=\s*[?.!]*$| (of|in|from) (this|these|the|each|all) ({MATERIAL_WORDS})\b)|"
+    rf"what (is|are) (this|these|the) ({MATERIAL_WORDS}) about|"
+    rf"({PART_WORDS}) \w+ (about|cover)|what does ({PART_WORDS}) \w+)",
+    re.IGNORECASE,
+)
+# Broad questions about everything rather than one part
+CORPUS_WIDE_PATTERN = re.compile(
+    r"\b(whole|entire|overall|all (the )?(documents|material|notes)|main topics|these documents|this document)\b",
+    re.IGNORECASE,
+)
+# A named part of the material ("chapter 3", "lecture iv") or a page range ("pages 10-20")
+PART_PATTERN = re.compile(rf"\b({PART_WORDS})\s+(\d+|[ivx]+)\b", re.IGNORECASE)
+PAGE_RANGE_PATTERN = re.compile(r"\bpages?\s+(\d+)(?:\s*(?:-|–|to|and)\s*(\d+))?", re.IGNORECASE)
+
+
+class SummaryIndex:
+    """Summary nodes (dicts with level, label, doc_id, chunk range, pages and text) plus their embeddings."""
+
+    def __init__(self, nodes, vectors, skipped=None):
+        self.nodes = nodes
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.skipped = skipped or [] # Labels of nodes left out because their summary request failed
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def save(self, directory):
+        with open(os.path.join(directory, SUMMARIES_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.nodes, f, indent=2)
+        np.save(os.path.join(directory, SUMMARY_VECTORS_FILE), self.vectors)
+
+    @classmethod
+    def load(cls, directory):
+        """Returns the saved index, or None if the directory has none."""
+        if not os.path.exists(os.path.join(directory, SUMMARIES_FILE)):
+            return None
+        with open(os.path.join(directory, SUMMARIES_FILE), encoding="utf-8") as f:
+            nodes = json.load(f)
+        return cls(nodes, np.load(os.path.join(directory, SUMMARY_VECTORS_FILE)))
+
+    def node_document(self, index):
+        node = self.nodes[index]
+        return Document(page_content=f"[{node['label']}]\n{node['text']}", metadata=dict(node, summary=True))
+
+
+def _section_ranges(corpus):
+    """Yields (doc_id, first_chunk, last_chunk) for groups of SECTION_CHUNKS consecutive chunks within a document."""
+    doc_ids = corpus.records["doc_id"]
+    start = 0
+    while start < len(doc_ids):
+        end = start
+        while end + 1 < len(doc_ids) and doc_ids[end + 1] == doc_ids[start] and end + 1 - start < SECTION_CHUNKS:
+            end += 1
+        yield int(doc_ids[start]), start, end
+        start = end + 1
+
+
+def _collect(nodes, responses, skipped):
+    """Stores each response's text on its node; returns the nodes whose request succeeded."""
+    kept = []
+    for node, response in zip(nodes, responses):
+        if isinstance(response, Exception):
+            skipped.append(node["label"])
+            continue
+        node["text"] = response.content.strip()
+        kept.append(node)
+    return kept
+
+
+def build_summary_index(corpus, embeddings, model, gateway):
+    """
+    Summarises the corpus bottom-up through the LLM gateway and embeds every summary node.
+    Nodes whose request fails are left out (listed in .skipped); if every section fails, the first error is raised.
+    """
+    skipped = []
+    sections = []
+    for doc_id, first, last in _section_ranges(corpus):
+        pages = corpus.records["page"][first:last + 1] + 1
+        sections.append({
+            "level": "section",
+            "doc_id": doc_id,
+            "chunks": [first, last],
+            "pages": [int(pages.min()), int(pages.max())],
+            "label": f"{corpus.documents[doc_id]}, pages {int(pages.min())}-{int(pages.max())}",
+        })
+    # All section summaries are requested at once; the gateway bounds concurrency and rate
+    responses = gateway.invoke_many(
+        model,
+        [build_messages("section_summary", corpus.span_text(*node["chunks"]), section_label=node["label"]) for node in sections],
+        tag=prompt_tag("section_summary"),
+    )
+    sections = _collect(sections, responses, skipped)
+    if not sections:
+        raise responses[0] # Nothing to build on; the gateway's error explains why
+
+    documents = []
+    doc_requests = []
+    for doc_id, name in enumerate(corpus.documents):
+        doc_sections = [node for node in sections if node["doc_id"] == doc_id]
+        if not doc_sections:
+            continue
+        node = {
+            "level": "document",
+            "doc_id": doc_id,
+            "chunks": [doc_sections[0]["chunks"][0], doc_sections[-1]["chunks"][1]],
+            "pages": [doc_sections[0]["pages"][0], doc_sections[-1]["pages"][1]],
+            "label": f"{name} (whole document)",
+        }
+        if len(doc_sections) == 1:
+            node["text"] = doc_sections[0]["text"]
+            documents.append(node)
+        else:
+            doc_requests.append((node, "\n\n".join(f"[{s['label']}]\n{s['text']}" for s in doc_sections)))
+    if doc_requests:
+        responses = gateway.invoke_many(
+            model,
+            [build_messages("document_summary", block, document_label=node["label"]) for node, block in doc_requests],
+            tag=prompt_tag("document_summary"),
+        )
+        documents.extend(_collect([node for node, _ in doc_requests], responses, skipped))
+        documents.sort(key=lambda node: node["doc_id"])
+
+    nodes = sections + documents
+    if len(documents) > 1:
+        block = "\n\n".join(f"[{d['label']}]\n{d['text']}" for d in documents)
+        corpus_node = {"level": "corpus", "doc_id": None, "chunks": [0, len(corpus) - 1], "pages": None, "label": "All documents"}
+        responses = gateway.invoke_many(model, [build_messages("document_summary", block, document_label="all documents")],
+                                        tag=prompt_tag("document_summary"))
+        nodes.extend(_collect([corpus_node], responses, skipped))
+
+    vectors = embeddings.embed_documents([f"{node['label']}\n{node['text']}" for node in nodes])
+    return SummaryIndex(nodes, vectors, skipped)
+
+
+def is_broad_question(question):
+    return bool(BROAD_QUESTION_PATTERN.search(question))
+
+
+def _cosine(vectors, query):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+
+
+def _same_part_number(found, number):
+    found = found.lower()
+    return int(found) == int(number) if found.isdigit() and number.isdigit() else found == number
+
+
+def _part_chunk_ranges(corpus, kind, number):
+    """(first_chunk, last_chunk) spans from each heading of the named part to the next heading of the same kind."""
+    # Searched on the raw buffer, so the corpus is never decoded as a whole
+    heading = re.compile(rb"(?im)^[ \t#*]*" + kind.encode() + rb"[ \t]+(\d+|[ivx]+)\b")
+    offsets = corpus.records["offset"]
+    doc_ids = corpus.records["doc_id"]
+    matches = list(heading.finditer(corpus.buffer))
+    ranges = []
+    for position, match in enumerate(matches):
+        if not _same_part_number(match.group(1).decode(), number):
+            continue
+        first = max(int(np.searchsorted(offsets, match.start(), side="right")) - 1, 0)
+        last = int(np.flatnonzero(doc_ids == doc_ids[first])[-1])
+        if position + 1 < len(matches):
+            # Up to the last chunk that starts before the next heading
+            last = min(last, max(int(np.searchsorted(offsets, matches[position + 1].start(), side="left")) - 1, first))
+        ranges.append((first, last))
+    return ranges
+
+
+def _targeted_nodes(question, summary_index, corpus):
+    """Summary node indices covering the part the question names, in document order; None if it names no part."""
+    nodes = summary_index.nodes
+    pages = PAGE_RANGE_PATTERN.search(question)
+    if pages:
+        first, last = int(pages.group(1)), int(pages.group(2) or pages.group(1))
+        return [i for i, node in enumerate(nodes)
+                if node["level"] == "section" and node["pages"][0] <= last and node["pages"][1] >= first]
+    part = PART_PATTERN.search(question)
+    if not part:
+        return None
+    kind, number = part.group(1).lower(), part.group(2).lower()
+    # Documents named after the part, e.g. "Lecture 3.pdf"
+    mention = re.compile(rf"\b{kind}\s*0*{number}\b", re.IGNORECASE)
+    doc_ids = {node["doc_id"] for node in nodes if node["level"] == "document" and mention.search(node["label"])}
+    if doc_ids:
+        return [i for i, node in enumerate(nodes) if node["doc_id"] in doc_ids and node["level"] == "document"] + \
+               [i for i, node in enumerate(nodes) if node["doc_id"] in doc_ids and node["level"] == "section"]
+    if corpus is None:
+        return []
+    spans = _part_chunk_ranges(corpus, kind, number)
+    return [i for i, node in enumerate(nodes)
+            if node["level"] == "section" and any(node["chunks"][0] <= last and node["chunks"][1] >= first for first, last in spans)]
+
+
+def route_query(question, query_vector, summary_index, vector_store, corpus=None, k=5, max_chars=SUMMARY_CONTEXT_CHARS):
+    """
+    Returns the Documents to answer from: the top-k leaf chunks, or summary nodes for a broad question.
+    A question naming a part ("summarize chapter 3", "pages 10-20") gets that part's summaries, or leaf
+    chunks if the part cannot be found. Otherwise summaries are only used when the best one scores at
+    least as well as the best leaf chunk, except for questions about the whole material.
+    """
+    leaf_docs = vector_store.similarity_search_by_vector(query_vector, k=k)
+    if summary_index is None or not len(summary_index) or not is_broad_question(question):
+        return leaf_docs
+    query = np.asarray(query_vector, dtype=np.float32)
+    scores = _cosine(summary_index.vectors, query)
+
+    ranked = _targeted_nodes(question, summary_index, corpus)
+    if ranked is not None:
+        if not ranked:
+            return leaf_docs
+    else:
+        ranked = [int(i) for i in np.argsort(-scores)]
+        if CORPUS_WIDE_PATTERN.search(question):
+            # Whole-material questions start from the widest summaries available
+            widest = [i for i in ranked if summary_index.nodes[i]["level"] == "corpus"] or \
+                     [i for i in ranked if summary_index.nodes[i]["level"] == "document"]
+            ranked = widest + [i for i in ranked if i not in widest]
+        elif leaf_docs:
+            leaf_vectors = [vector_store.index.reconstruct(int(doc.metadata["chunk"])) for doc in leaf_docs]
+            if scores[ranked[0]] < _cosine(leaf_vectors, query).max():
+                return leaf_docs
+
+    selected, used = [], 0
+    for i in ranked:
+        doc = summary_index.node_document(i)
+        if used + len(doc.page_content) > max_chars and selected:
+            break
+        selected.append(doc)
+        used += len(doc.page_content)
+    return selected
@@ -0,0 +1,107 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from drive_sync import DriveSync, MANIFEST_FILE
+from fake_drive import FakeDrive
+
+DOC_MIME_TYPE = "application/vnd.google-apps.document"
+
+
+def read(mirror, path):
+    with open(os.path.join(mirror, path), "rb") as f:
+        return f.read()
+
+
+def mirror_files(mirror):
+    found = set()
+    for root, _, files in os.walk(mirror):
+        for name in files:
+            if name != MANIFEST_FILE:
+                found.add(os.path.relpath(os.path.join(root, name), mirror))
+    return found
+
+
+def test_incremental_sync_against_fake_drive(tmp_path):
+    mirror = str(tmp_path / "mirror")
+    drive = FakeDrive(page_size=2) # Forces pagination
+    course = drive.add_folder("Course")
+    week1 = drive.add_folder("Week 1", parent=course)
+    week2 = drive.add_folder("Week 2", parent=week1) # Nested two levels deep
+    notes = drive.add_file("notes.txt", b"notes v1", parent=course)
+    slides = drive.add_file("slides.pdf", b"%PDF slides", parent=week1, mime_type="application/pdf")
+    doc = drive.add_file("Summary", b"doc v1", parent=week2, mime_type=DOC_MIME_TYPE)
+    old = drive.add_file("old.txt", b"old", parent=week1)
+    dup_a = drive.add_file("dup.txt", b"first", parent=course)
+    dup_b = drive.add_file("dup.txt", b"second", parent=course)
+    drive.add_file("image.png", b"png", parent=course, mime_type="image/png") # Unsupported, skipped
+    syncer = DriveSync(lambda: drive, mirror)
+
+    first = syncer.sync(course)
+    expected = {"notes.txt", "dup.txt", f"dup__{dup_b}.txt", os.path.join("Week 1", "slides.pdf"),
+                os.path.join("Week 1", "old.txt"), os.path.join("Week 1", "Week 2", "Summary.txt")}
+    assert set(first.added) == expected
+    assert mirror_files(mirror) == expected
+    assert first.changed == first.removed == first.failed == []
+    assert {read(mirror, "dup.txt"), read(mirror, f"dup__{dup_b}.txt")} == {b"first", b"second"}
+
+    downloads = drive.calls["download"]
+    assert syncer.sync(course).delta == []
+    assert drive.calls["download"] == downloads
+
+    drive.update(notes, content=b"notes v2") # New md5
+    drive.touch(slides) # Newer modifiedTime, same md5: not re-downloaded
+    drive.update(doc, content=b"doc v2") # Google-native: detected by modifiedTime
+    drive.trash(old)
+    drive.update(dup_a, name="renamed.txt", parent=week1)
+    new = drive.add_file("new.txt", b"new", parent=week2)
+    drive.failing.add(new)
+
+    second = syncer.sync(course)
+    assert set(second.changed) == {"notes.txt", "dup.txt", os.path.join("Week 1", "Week 2", "Summary.txt"), os.path.join("Week 1", "renamed.txt")}
+    assert second.removed == [os.path.join("Week 1", "old.txt")]
+    assert [path for path, _ in second.failed] == [os.path.join("Week 1", "Week 2", "new.txt")]
+    assert second.added == []
+    assert os.path.join("Week 1", "slides.pdf") in second.unchanged
+    assert read(mirror, "notes.txt") == b"notes v2"
+    assert read(mirror, os.path.join("Week 1", "Week 2", "Summary.txt")) == b"doc v2"
+    assert read(mirror, os.path.join("Week 1", "renamed.txt")) == b"first"
+    # The rename leaves dup__<id>.txt as the only dup.txt, so it takes the plain name
+    assert mirror_files(mirror) == {"notes.txt", "dup.txt", os.path.join("Week 1", "slides.pdf"),
+                                    os.path.join("Week 1", "renamed.txt"), os.path.join("Week 1", "Week 2", "Summary.txt")}
+
+    # A failed download is retried on the next sync
+    drive.failing.clear()
+    third = syncer.sync(course)
+    assert third.added == [os.path.join("Week 1", "Week 2", "new.txt")]
+    assert third.changed == third.failed == []
+
+
+def test_sync_keeps_hostile_names_inside_the_mirror(tmp_path):
+    mirror = str(tmp_path / "mirror")
+    drive = FakeDrive()
+    root = drive.add_folder("Root")
+    up = drive.add_folder("..", parent=root)
+    drive.add_file("pwn.txt", b"x", parent=up)
+    drive.add_file("..", b"x", parent=root, mime_type=DOC_MIME_TYPE)
+    drive.add_file("../../escape.txt", b"x", parent=root)
+
+    result = DriveSync(lambda: drive, mirror).sync(root)
+    assert result.failed == []
+    assert not os.path.exists(tmp_path / "pwn.txt")
+    assert sorted(os.listdir(tmp_path)) == ["mirror", "mirror.lock"] # Nothing written beside the mirror but its sync lock
+    assert mirror_files(mirror) == {os.path.join("_", "pwn.txt"), "_.txt", ".._.._escape.txt"}
+
+
+def test_concurrent_syncs_of_one_mirror_do_not_collide(tmp_path):
+    mirror = str(tmp_path / "mirror")
+    drive = FakeDrive()
+    root = drive.add_folder("Root")
+    for i in range(20):
+        drive.add_file(f"f{i}.txt", f"content {i}".encode(), parent=root)
+
+    # Like several sessions of one class loading the same folder at once
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda _: DriveSync(lambda: drive, mirror).sync(root), range(3)))
+    assert all(result.failed == [] for result in results)
+    assert sum(len(result.added) for result in results) == 20 # Each file downloaded once; later syncs see it unchanged
+    assert mirror_files(mirror) == {f"f{i}.txt" for i in range(20)}
+    assert len(DriveSync(lambda: drive, mirror).load_manifest()["files"]) == 20
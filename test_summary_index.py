@@ -0,0 +1,92 @@
+import numpy as np
+from langchain_core.documents import Document
+from summary_index import SummaryIndex, is_broad_question, route_query
+
+RECORD_DTYPE = np.dtype([("offset", np.int64), ("length", np.int64), ("doc_id", np.int32), ("page", np.int32)])
+
+
+class FakeIndex:
+    def __init__(self, vectors):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+
+    def reconstruct(self, i):
+        return self.vectors[i]
+
+
+class FakeVectorStore:
+    """Exact cosine search over chunk vectors, returning Documents with the same metadata as CorpusDocstore."""
+
+    def __init__(self, vectors):
+        self.index = FakeIndex(vectors)
+
+    def similarity_search_by_vector(self, vector, k=5):
+        order = np.argsort(-(self.index.vectors @ np.asarray(vector, dtype=np.float32)))[:k]
+        return [Document(page_content=f"chunk {i}", metadata={"chunk": int(i)}) for i in order]
+
+
+class FakeCorpus:
+    def __init__(self, chunks):
+        text, rows = "", []
+        for doc_id, page, chunk in chunks:
+            rows.append((len(text.encode("utf-8")), len(chunk.encode("utf-8")), doc_id, page))
+            text += chunk + "\n"
+        self.buffer = text.encode("utf-8")
+        self.records = np.array(rows, dtype=RECORD_DTYPE)
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def section(doc_id, first, last, label):
+    return {"level": "section", "doc_id": doc_id, "chunks": [first, last], "pages": [first + 1, last + 1], "label": label, "text": label}
+
+
+CORPUS = FakeCorpus([
+    (0, 0, "Chapter 1\nThermodynamics basics"),
+    (0, 1, "Entropy is defined as ..."),
+    (0, 2, "Chapter 2\nHeat engines"),
+    (0, 3, "Carnot cycle, see Chapter 1"),
+    (0, 4, "Chapter 3\nStatistical mechanics"),
+    (0, 5, "Partition functions"),
+])
+CHUNK_VECTORS = [unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1), unit(0, 0, 1), unit(1, 1, 0), unit(1, 1, 0)]
+SUMMARIES = SummaryIndex(
+    [section(0, 0, 1, "Doc, pages 1-2"), section(0, 2, 3, "Doc, pages 3-4"), section(0, 4, 5, "Doc, pages 5-6"),
+     {"level": "document", "doc_id": 0, "chunks": [0, 5], "pages": [1, 6], "label": "Doc (whole document)", "text": "All"}],
+    [unit(1, 0.2, 0), unit(0, 0.2, 1), unit(1, 1, 0.1), unit(1, 1, 1)],
+)
+
+
+def route(question, query):
+    return route_query(question, query, SUMMARIES, FakeVectorStore(CHUNK_VECTORS), CORPUS, k=2)
+
+
+def test_specific_questions_are_not_broad():
+    assert not is_broad_question("Explain the key points of entropy")
+    assert not is_broad_question("Give an outline of the proof of the second law")
+    assert is_broad_question("What are the key points?")
+    assert is_broad_question("What are the main ideas of these notes?")
+    assert is_broad_question("Summarize chapter 3")
+
+
+def test_broad_question_falls_back_to_leaf_chunks_when_they_match_better():
+    docs = route("Summarize entropy", unit(0, 1, 0))
+    assert [doc.metadata.get("chunk") for doc in docs] == [1, 4]
+
+
+def test_broad_question_uses_summaries_when_they_match_better():
+    docs = route("Summarize the heat engine part", unit(0.1, 0.3, 1))
+    assert docs[0].metadata["summary"] and docs[0].metadata["label"] == "Doc, pages 3-4"
+
+
+def test_named_chapter_is_located_by_its_heading():
+    # The query vector points elsewhere; the heading decides, and "see Chapter 1" in chunk 3 is not a heading
+    assert [doc.metadata["label"] for doc in route("Summarize chapter 2", unit(1, 0, 0))] == ["Doc, pages 3-4"]
+    assert [doc.metadata["label"] for doc in route("summarize pages 4-5", unit(1, 0, 0))] == ["Doc, pages 3-4", "Doc, pages 5-6"]
+
+
+def test_unknown_chapter_uses_leaf_chunks():
+    docs = route("Summarize chapter 9", unit(1, 0, 0))
+    assert all("summary" not in doc.metadata for doc in docs)